@@ -16,30 +16,70 @@
 
 """electrostatics.py - classes for electrostatics problems"""
 
+import copy
 import functools
+import hashlib
+import os
+import tempfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy
-from numpy import array, arange, linspace, meshgrid, zeros_like, ones_like
+from numpy import array, arange, linspace, meshgrid, zeros_like
 from numpy import log10, sin, cos, arctan2, arccos, sqrt, fabs, cumsum
-from numpy import radians, pi, infty
 from numpy import dot, cross
-from numpy import alltrue, isclose
+from numpy import isclose
 from numpy import where, insert
 from numpy import newaxis
 from numpy.linalg import det
 
 from scipy.integrate import ode
+from scipy.special import ellipeinc, ellipkinc
+from scipy.signal import fftconvolve
 from scipy.interpolate import splrep, splev
 
 import matplotlib
 from matplotlib import pyplot
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.figure import Figure
+from matplotlib.patches import Circle
 
-# The area of interest
+# The default area of interest (see init() and Domain)
 XMIN, XMAX = None, None
 YMIN, YMAX = None, None
 ZOOM = None
 XOFFSET = None
 
+# The field shared with each worker process by ElectricField.lines()
+_WORKER_FIELD = None
+
+# The Dormand-Prince 5(4) tableau used by ElectricField.lines(): the stage
+# coefficients, the 5th-order weights, the error weights and the dense output
+# polynomial coefficients (Hairer, Norsett and Wanner, Solving Ordinary
+# Differential Equations I, sec. II.5 and II.6)
+_DOPRI_A = [[], [1/5], [3/40, 9/40], [44/45, -56/15, 32/9],
+            [19372/6561, -25360/2187, 64448/6561, -212/729],
+            [9017/3168, -355/33, 46732/5247, 49/176, -5103/18656]]
+_DOPRI_B = array([35/384, 0, 500/1113, 125/192, -2187/6784, 11/84])
+_DOPRI_E = array([-71/57600, 0, 71/16695, -71/1920, 17253/339200, -22/525,
+                  1/40])
+_DOPRI_P = array([
+    [1, -8048581381/2820520608, 8663915743/2820520608,
+     -12715105075/11282082432],
+    [0, 0, 0, 0],
+    [0, 131558114200/32700410799, -68118460800/10900136933,
+     87487479700/32700410799],
+    [0, -1754552775/470086768, 14199869525/1410260304,
+     -10690763975/1880347072],
+    [0, 127303824393/49829197408, -318862633887/49829197408,
+     701980252875/199316789632],
+    [0, -282668133/205662961, 2019193451/616988883, -1453857185/822651844],
+    [0, 40617522/29380423, -110615467/29380423, 69997945/29380423]])
+
 
 #-----------------------------------------------------------------------------
 # Decorators
@@ -53,17 +93,129 @@ def arrayargs(func):
     return wrapper
 
 
+#-----------------------------------------------------------------------------
+# Backends
+
+class Backend:
+    """Evaluates elementwise array expressions with numpy.
+
+    Expressions are strings in the common subset of numpy and numexpr
+    syntax (arithmetic, comparisons, where(), sqrt(), log(), ...) that
+    refer to the arrays in a local dictionary."""
+
+    name = 'numpy'
+
+    namespace = {name: getattr(numpy, name) for name in
+                 ('where', 'sqrt', 'log', 'exp', 'sin', 'cos', 'arctan2',
+                  'abs')}
+
+    def __init__(self):
+        """Initializes the cache of compiled expressions."""
+        self.compiled = {}
+
+    def evaluate(self, expr, local_dict):
+        """Returns the value of the expression 'expr' using the arrays in
+        'local_dict'."""
+        if expr not in self.compiled:
+            self.compiled[expr] = compile(expr, '<%s>' % self.name, 'eval')
+        # pylint: disable=eval-used
+        return eval(self.compiled[expr], self.namespace, local_dict)
+
+
+class NumexprBackend(Backend):
+    """Evaluates elementwise array expressions with numexpr.
+
+    numexpr compiles each expression into a fused loop that runs over
+    chunks of the operands on several threads, so no full-size temporaries
+    are allocated.  Small operands are handed to numpy, for which the call
+    overhead is lower."""
+
+    name = 'numexpr'
+
+    minsize = 4096  # The smallest operand size to evaluate with numexpr
+
+    def __init__(self, threads=None):
+        """Initializes the backend.  The number of 'threads' defaults to
+        numexpr's choice."""
+        super().__init__()
+        import numexpr  # pylint: disable=import-outside-toplevel
+        self.numexpr = numexpr
+        if threads is not None:
+            numexpr.set_num_threads(threads)
+
+    def evaluate(self, expr, local_dict):
+        size = max(numpy.size(a) for a in local_dict.values())
+        if size < self.minsize:
+            return super().evaluate(expr, local_dict)
+        return self.numexpr.evaluate(expr, local_dict=local_dict)
+
+
+# The backend used to evaluate the field and potential kernels
+_BACKEND = Backend()
+
+def set_backend(name='numpy', **kwargs):
+    """Selects the backend ('numpy' or 'numexpr') used to evaluate fields and
+    potentials.  Keyword arguments are passed to the backend.  An ImportError
+    is raised if the backend's package is not installed."""
+    backends = {cls.name: cls for cls in (Backend, NumexprBackend)}
+    if name not in backends:
+        raise ValueError('Unknown backend: %s' % name)
+    global _BACKEND  # pylint: disable=global-statement
+    _BACKEND = backends[name](**kwargs)
+
+def get_backend():
+    """Returns the backend used to evaluate fields and potentials."""
+    return _BACKEND
+
+def evaluate(expr, **arrays):
+    """Evaluates the expression 'expr' with the current backend."""
+    return _BACKEND.evaluate(expr, arrays)
+
+
 #-----------------------------------------------------------------------------
 # Functions
 
 # pylint: disable=too-many-arguments
 def init(xmin, xmax, ymin, ymax, zoom=1, xoffset=0):
-    """Initializes the domain."""
+    """Initializes the default domain, which is used by fields, grids and
+    plots that are not given a Domain."""
     # pylint: disable=global-statement
     global XMIN, XMAX, YMIN, YMAX, ZOOM, XOFFSET
     XMIN, XMAX, YMIN, YMAX, ZOOM, XOFFSET = \
       xmin, xmax, ymin, ymax, zoom, xoffset
 
+def get_domain(domain=None):
+    """Returns 'domain' if it is given, or else the default domain set using
+    init()."""
+    if domain is not None:
+        return domain
+    if None in [XMIN, XMAX, YMIN, YMAX]:
+        raise ValueError('Domain must be set using init().')
+    return Domain(XMIN, XMAX, YMIN, YMAX, ZOOM, XOFFSET)
+
+def fingerprint(*parts):
+    """Returns a hex digest that identifies 'parts'.  Objects such as charges
+    are identified by their type and attributes, and numbers and arrays by
+    their values, so equal configurations share a digest."""
+    def state(part):
+        """Returns a representation of part that has an exact repr."""
+        if isinstance(part, (list, tuple)):
+            return [state(p) for p in part]
+        if hasattr(part, '__dict__'):
+            return [type(part).__name__] + \
+              [(k, state(v)) for k, v in sorted(vars(part).items())]
+        if isinstance(part, (numpy.ndarray, numpy.number, int, float)):
+            return numpy.asarray(part, dtype=float).tolist()
+        return part
+    return hashlib.sha1(repr(state(parts)).encode()).hexdigest()
+
+def charge_state(charge):
+    """Returns a snapshot of the identity and attributes (e.g., q and x) of
+    a 'charge' that compares unequal once the charge is modified."""
+    return (id(charge),) + tuple(
+        numpy.array(v).tobytes() if isinstance(v, (list, tuple, numpy.ndarray))
+        else v for v in vars(charge).values())
+
 def norm(x):
     """Returns the magnitude of the vector x."""
     return sqrt(numpy.sum(array(x)**2, axis=-1))
@@ -75,6 +227,15 @@ def point_line_distance(x0, x1, x2):
     assert x1.shape == x2.shape == (2,)
     return fabs(cross(x0-x1, x0-x2))/norm(x2-x1)
 
+@arrayargs
+def point_segment_distance(x0, x1, x2):
+    """Finds the shortest distance between the point x0 and the line segment
+    from x1 to x2."""
+    assert x1.shape == x2.shape == (2,)
+    dx = x2 - x1
+    t = numpy.clip(dot(x0-x1, dx)/dot(dx, dx), 0, 1)
+    return norm(x0 - x1 - array(t)[..., newaxis]*dx)
+
 @arrayargs
 def angle(x0, x1, x2):
     """Returns angle between three points.
@@ -93,6 +254,56 @@ def is_left(x0, x1, x2):
         matrix = matrix.transpose((1, 2, 0))
     return det(matrix) > 0
 
+# pylint: disable=invalid-name
+def segment_E(x, x1, x2, lam):
+    """Returns the electric field at the point(s) x owing to uniformly
+    charged line segments from x1 to x2 with linear charge densities lam.
+    The segments are given as arrays of shape (S, 2), (S, 2) and (S,).
+
+    The field of each segment is evaluated in closed form in the segment's
+    local frame, where u and v are the coordinates along and perpendicular
+    to the segment, and summed over the segments in one broadcast pass.
+    Ref: http://www.phys.uri.edu/gerhard/PHY204/tsl31.pdf
+    """
+    x = array(x, dtype=float)[..., newaxis, :]
+    L = norm(x2 - x1)
+    tx, ty = ((x2 - x1)/L[:, newaxis]).T
+    rx, ry = x[..., 0] - x1[:, 0], x[..., 1] - x1[:, 1]
+    u = evaluate('rx*tx + ry*ty', rx=rx, ry=ry, tx=tx, ty=ty)
+    v = evaluate('ry*tx - rx*ty', rx=rx, ry=ry, tx=tx, ty=ty)
+    Epara = evaluate('lam*(1/sqrt((u-L)**2 + v**2) - 1/sqrt(u**2 + v**2))',
+                     lam=lam, u=u, v=v, L=L)
+    Eperp = evaluate('lam*(u/sqrt(u**2 + v**2) - (u-L)/sqrt((u-L)**2 + v**2))'
+                     '/where(v == 0, inf, v)',
+                     lam=lam, u=u, v=v, L=L, inf=numpy.inf)
+    return numpy.stack([numpy.sum(evaluate('a*tx - b*ty', a=Epara, b=Eperp,
+                                           tx=tx, ty=ty), axis=-1),
+                        numpy.sum(evaluate('a*ty + b*tx', a=Epara, b=Eperp,
+                                           tx=tx, ty=ty), axis=-1)],
+                       axis=-1)
+
+# pylint: disable=invalid-name
+def segment_V(x, x1, x2, lam):
+    """Returns the potential at the point(s) x owing to uniformly charged
+    line segments (see segment_E()).
+    Ref: https://aapt.scitation.org/doi/pdf/10.1119/1.2348889
+    """
+    x = array(x, dtype=float)[..., newaxis, :]
+    L = norm(x2 - x1)
+    r1 = evaluate('sqrt((x - x1)**2 + (y - y1)**2)',
+                  x=x[..., 0], y=x[..., 1], x1=x1[:, 0], y1=x1[:, 1])
+    r2 = evaluate('sqrt((x - x2)**2 + (y - y2)**2)',
+                  x=x[..., 0], y=x[..., 1], x2=x2[:, 0], y2=x2[:, 1])
+    return numpy.sum(evaluate('lam*log((r1 + r2 + L)/(r1 + r2 - L))',
+                              lam=lam, r1=r1, r2=r2, L=L), axis=-1)
+
+def turning_angle(a, b):
+    """Returns the unsigned angle (in radians) turned from vector a to vector
+    b.  Both a and b may be arrays of vectors."""
+    a, b = array(a), array(b)
+    return fabs(arctan2(a[..., 0]*b[..., 1] - a[..., 1]*b[..., 0],
+                        numpy.sum(a*b, axis=-1)))
+
 def lininterp2(x1, y1, x):
     """Linear interpolation at points x between numpy arrays (x1, y1).
     Only y1 is allowed to be two-dimensional.  The x1 values should be sorted
@@ -101,19 +312,409 @@ def lininterp2(x1, y1, x):
     """
     return splev(x, splrep(x1, y1, s=0, k=1))
 
-def finalize_plot():
-    """Finalizes the plot."""
-    ax = pyplot.gca()
+def _circle_flux(circles, charges):
+    """Returns a function that gives the flux of the point 'charges' out
+    through the 'circles' from a fixed angle to the angles a (one row per
+    circle), and the flux per unit angle at a.  Flatland fluxes follow from
+    the angle subtended at the charge; the others are given by incomplete
+    elliptic integrals."""
+    o = array([circle.x for circle in circles], dtype=float)
+    r = array([circle.r for circle in circles],
+              dtype=float)[:, newaxis, newaxis]
+    groups = []
+    for flatland in [False, True]:
+        group = [c for c in charges if (type(c) is PointChargeFlatland) ==
+                 flatland]
+        if group:
+            p = array([c.x for c in group], dtype=float)[newaxis] - \
+              o[:, newaxis]
+            groups.append((flatland, array([c.q for c in group], dtype=float),
+                           norm(p)[..., newaxis],
+                           arctan2(p[..., 1], p[..., 0])[..., newaxis]))
+
+    def flux(a, cumulative=True, rows=slice(None)):
+        """Returns the flux (unless not 'cumulative') and flux density at
+        the angles a through the circles with the given 'rows'."""
+        total, density = 0, 0
+        for flatland, q, d, b in groups:
+            d, b, rr = d[rows], b[rows], r[rows]
+            th = a[:, newaxis, :] - b
+            costh, sinth = cos(th), sin(th)
+            w = rr*rr + d*d - 2*rr*d*costh
+            f = (rr - d*costh)/(w if flatland else w*sqrt(w))
+            density = density + numpy.einsum('j,ijk->ik', q, f)
+            if not cumulative:
+                continue
+            if flatland:
+                F = where(d < rr, th + arctan2(d*sinth, rr - d*costh),
+                          numpy.pi + arctan2(-rr*sinth, d - rr*costh))/rr
+            else:
+                m = 4*rr*d/(rr+d)**2
+                t = (numpy.pi - th)/2
+                s, c = sin(t), cos(t)
+                j3 = (ellipeinc(t, m) - m*s*c/sqrt(1 - m*s*s))/(1 - m)
+                F = -((rr-d)*j3 + (rr+d)*ellipkinc(t, m))/(rr*(rr+d)**2)
+            total = total + numpy.einsum('j,ijk->ik', q, F)
+        return total, density
+
+    return flux
+
+# pylint: disable=too-many-locals
+def fluxpoints(circles, field, n, uniform=False):
+    """Returns a list of the flux points of each of the GaussianCircles
+    'circles' (see GaussianCircle.fluxpoints()).
+
+    For fields of point charges the cumulative flux is found in closed form
+    and inverted by Newton's method.  Otherwise the flux is integrated from
+    samples of the field on the circles, which are doubled until the
+    points converge."""
+    circles = list(circles)
+    a0 = array([circle.a0 for circle in circles], dtype=float)[:, newaxis]
+    u = linspace(0, 1, n+1)[:-1]
+    charges = field.charges
+    analytic = bool(charges) and all(
+        type(c) in (PointCharge, PointChargeFlatland) for c in charges)
+    if analytic:
+        # Charges on a circle are singular
+        x = array([c.x for c in charges], dtype=float)
+        d = norm(x[newaxis] - array([c.x for c in circles],
+                                    dtype=float)[:, newaxis])
+        analytic = not isclose(d, [[c.r] for c in circles]).any()
+
+    if uniform:
+        a = a0 + 2*numpy.pi*u
+
+    elif analytic:
+        # Check that the fluxes are either all in or all out, start from the
+        # integrated flux density and polish the points by Newton's method,
+        # falling back on bisection
+        flux = _circle_flux(circles, charges)
+        f0 = flux(numpy.hstack([a0, a0+2*numpy.pi]))[0]
+        sign = numpy.sign(f0[:, 1:] - f0[:, :1])
+        total = fabs(f0[:, 1:] - f0[:, :1])
+        v = total*u
+        ag = a0 + linspace(0, 2*numpy.pi, 257)
+        dg = sign*flux(ag, False)[1]
+        assert numpy.all(dg > 0)
+        cg = numpy.insert(numpy.cumsum(dg[:, :-1] + dg[:, 1:], axis=1), 0, 0,
+                          axis=1)
+        cg *= total/cg[:, -1:]
+        a = array([numpy.interp(x, f, b) for f, x, b in zip(cg, v, ag)])
+        lo, hi = a0 + zeros_like(a), a0 + 2*numpy.pi + zeros_like(a)
+        rows = numpy.arange(len(circles))
+        for _ in range(50):
+            f, df = flux(a[rows], rows=rows)
+            dv = sign[rows]*(f - f0[rows, :1]) - v[rows]
+            done = (fabs(dv) <= 1e-10*total[rows]).all(axis=1)
+            dv, df, rows = dv[~done], df[~done], rows[~done]
+            if not len(rows):  # pylint: disable=len-as-condition
+                break
+            lo[rows] = where(dv < 0, a[rows], lo[rows])
+            hi[rows] = where(dv > 0, a[rows], hi[rows])
+            x = a[rows] - dv/(sign[rows]*df)
+            a[rows] = where((lo[rows] <= x) & (x <= hi[rows]), x,
+                            (lo[rows]+hi[rows])/2)
+
+    else:
+        # Integrate the flux with the trapezoid rule, doubling the samples
+        # until the points stop moving
+        projection = lambda a: field.projection(
+            _circle_points(circles, a).reshape(-1, 2), a.ravel()).reshape(
+                a.shape)
+        ag = a0 + linspace(0, 2*numpy.pi, 1025)
+        flux, a = projection(ag), None
+        while True:
+            sign = numpy.sign(numpy.sum(flux[:, :-1], axis=1))[:, newaxis]
+            assert numpy.all(sign*flux > 0)
+            intflux = numpy.cumsum(sign*(flux[:, :-1]+flux[:, 1:])/2, axis=1)
+            intflux = numpy.insert(intflux, 0, 0, axis=1)
+            a1 = array([numpy.interp(f[-1]*u, f, b)
+                        for f, b in zip(intflux, ag)])
+            if a is not None and fabs(a1-a).max() < 1e-6 or \
+              ag.shape[1] > 2**16:
+                a = a1
+                break
+            a = a1
+            mid = (ag[:, :-1] + ag[:, 1:])/2
+            ag = numpy.stack([ag[:, :-1], mid], axis=-1).reshape(
+                len(ag), -1), ag[:, -1:]
+            ag = numpy.concatenate(ag, axis=1)
+            flux = numpy.concatenate(
+                [numpy.stack([flux[:, :-1], projection(mid)], axis=-1)
+                 .reshape(len(flux), -1), flux[:, -1:]], axis=1)
+
+    return list(_circle_points(circles, a))
+
+def _circle_points(circles, a):
+    """Returns the points at angles 'a' (one row per circle) on each of the
+    'circles'."""
+    o = array([circle.x for circle in circles], dtype=float)
+    r = array([circle.r for circle in circles], dtype=float)
+    return r[:, newaxis, newaxis]*numpy.stack([cos(a), sin(a)], axis=-1) + \
+      o[:, newaxis]
+
+def viewaxes(resolution=200, domain=None):
+    """Returns the x and y sample coordinates spanning the plotting view of
+    the 'domain' (see get_domain()).  The 'resolution' is the number of
+    samples along each axis, or an (nx, ny) pair."""
+    xmin, xmax, ymin, ymax = get_domain(domain).view()
+    nx, ny = (resolution, resolution) if numpy.isscalar(resolution) \
+      else resolution
+    return linspace(xmin, xmax, nx), linspace(ymin, ymax, ny)
+
+def viewgrid(resolution=200, domain=None):
+    """Returns x, y meshgrid arrays spanning the plotting view (see
+    viewaxes())."""
+    return meshgrid(*viewaxes(resolution, domain))
+
+# pylint: disable=too-many-locals, too-many-arguments
+def adaptive_sample(func, levels, resolution=200, depth=4, tol=0.25,
+                    domain=None):
+    """Samples the function 'func', which maps an (N, 2) array of points to
+    N values, over the plotting view on an adaptive quadtree for contouring
+    at the given 'levels'.
+
+    Sampling starts from cells 2**depth times coarser than a uniform grid
+    of the given 'resolution'.  A cell is split in four where a contour
+    crosses it (its corner and centre values fall between different levels,
+    or are not finite), or where the value at its centre differs from the
+    mean of its corners by more than 'tol' times the level spacing.  The
+    finest cells are at least as fine as the uniform grid.  Each round of
+    refinement evaluates only the new nodes, in one batched call.  Returns
+    the x, y and function values at the nodes as 1-D arrays, for use with
+    tricontour()."""
+    x, y = viewaxes(resolution, domain)
+    scale = 2**depth
+    nx, ny = [max(1, -(-(len(a)-1)//scale)) for a in (x, y)]  # Coarse cells
+    hx, hy = (x[-1]-x[0])/(nx*scale), (y[-1]-y[0])/(ny*scale)
+    stride = ny*scale + 1
+    levels = numpy.sort(levels)
+    spacing = numpy.min(numpy.diff(levels)) if len(levels) > 1 else numpy.inf
+
+    # Nodes are keyed by their indices on the finest grid
+    keys, values = numpy.zeros(0, dtype=numpy.int64), numpy.zeros(0)
+    def lookup(i, j):
+        """Returns the values at the nodes with indices i and j, evaluating
+        func at the nodes that have not been visited."""
+        nonlocal keys, values
+        k = i*stride + j
+        new = numpy.unique(k[~numpy.isin(k, keys)])
+        if new.size:
+            points = numpy.stack([x[0] + new//stride*hx,
+                                  y[0] + new%stride*hy], axis=-1)
+            keys = numpy.concatenate([keys, new])
+            values = numpy.concatenate([values, func(points)])
+            order = numpy.argsort(keys)
+            keys, values = keys[order], values[order]
+        return values[numpy.searchsorted(keys, k)]
+
+    # Refine the cells, given by their lower-left node indices i, j and size
+    i, j = [a.ravel() for a in meshgrid(arange(nx)*scale, arange(ny)*scale)]
+    size = scale
+    while i.size:
+        corners = lookup(numpy.concatenate([i, i+size, i, i+size]),
+                         numpy.concatenate([j, j, j+size, j+size]))
+        if size == 1:
+            break
+        corners = corners.reshape(4, -1)
+        centre = lookup(i+size//2, j+size//2)
+        v = numpy.concatenate([corners, centre[newaxis]])
+        bins = numpy.digitize(v, levels)
+        with numpy.errstate(invalid='ignore'):
+            split = (bins.min(axis=0) != bins.max(axis=0)) | \
+              ~numpy.isfinite(v).all(axis=0) | \
+              (fabs(centre - corners.mean(axis=0)) > tol*spacing)
+        size //= 2
+        i, j = i[split], j[split]
+        i = numpy.concatenate([i, i+size, i, i+size])
+        j = numpy.concatenate([j, j, j+size, j+size])
+
+    return x[0] + keys//stride*hx, y[0] + keys%stride*hy, values
+
+def write_grids(field, prefix, resolution=8192, maxbytes=2**28):
+    """Evaluates the ElectricField 'field' over the plotting view and writes
+    the grids to .npy files named '<prefix>-<name>.npy', where the names are
+    x and y (the sample coordinates), Ex, Ey, E (the field magnitude) and V
+    (the potential; omitted if it is not implemented for the charges).
+
+    The view is evaluated in tiles of whole rows, which are contiguous in
+    the files, and each tile is written straight into arrays that map just
+    the tile's part of the files.  Tiles and the evaluation kernels together
+    use at most about 'maxbytes' of memory.  Returns a dict of the grids,
+    memory-mapped read-only."""
+    x, y = viewaxes(resolution, field.domain)
+    chargeset = copy.copy(field.packed())
+    chargeset.maxbytes = maxbytes//2  # Half for the kernels
+    rows = max(1, maxbytes//2 // (96*len(x)))  # Half for the tile arrays
+
+    # Find out whether the potential can be evaluated
+    try:
+        chargeset.V(array([x[0], y[0]]))
+        names = ['Ex', 'Ey', 'E', 'V']
+    except RuntimeError:
+        names = ['Ex', 'Ey', 'E']
+
+    paths = {name: '%s-%s.npy' % (prefix, name) for name in ['x', 'y']+names}
+    numpy.save(paths['x'], x)
+    numpy.save(paths['y'], y)
+    offset = 0
+    for name in names:  # Creates the files and finds the header length
+        offset = numpy.lib.format.open_memmap(paths[name], mode='w+',
+                                              dtype=float,
+                                              shape=(len(y), len(x))).offset
+
+    for start in range(0, len(y), rows):
+        stop = min(start+rows, len(y))
+        points = numpy.stack(meshgrid(x, y[start:stop]),
+                             axis=-1).reshape(-1, 2)
+        e = chargeset.E(points).reshape(stop-start, len(x), 2)
+        tile = {'Ex': e[..., 0], 'Ey': e[..., 1], 'E': norm(e)}
+        if 'V' in names:
+            tile['V'] = chargeset.V(points).reshape(stop-start, len(x))
+        for name in names:
+            grid = numpy.memmap(paths[name], dtype=float, mode='r+',
+                                offset=offset + start*len(x)*8,
+                                shape=(stop-start, len(x)))
+            grid[:] = tile[name]
+            grid.flush()
+            del grid  # Unmaps the tile
+    return {name: numpy.load(path, mmap_mode='r')
+            for name, path in paths.items()}
+
+def _init_worker(field, domain):
+    """Initializes a worker process for parallel field-line tracing."""
+    # pylint: disable=global-statement
+    global _WORKER_FIELD
+    _WORKER_FIELD = field
+    init(*domain)
+
+def _trace_worker(seed, tol, mode):
+    """Traces the field line through 'seed' in a worker process."""
+    return _WORKER_FIELD.lines([seed], tol, mode=mode)[0]
+
+def trace_report(fieldlines, worst=5):
+    """Returns a report on the tracing statistics of 'fieldlines' that gives
+    the totals, the termination reasons and the 'worst' directions that took
+    the longest to trace.  Lines without stats (e.g., from a cache) are
+    counted but otherwise ignored."""
+    stats = [s for line in fieldlines if line.stats for s in line.stats]
+    report = ['%d field lines (%d without stats), %d directions traced' %
+              (len(fieldlines),
+               sum(1 for line in fieldlines if not line.stats), len(stats))]
+    if not stats:
+        return report[0]
+    for name in ['steps', 'nfev', 'time']:
+        values = array([getattr(s, name) for s in stats], dtype=float)
+        report.append('  %-6s total %-10.4g mean %-10.4g max %.4g' %
+                      (name, values.sum(), values.mean(), values.max()))
+    reasons = [TraceStats.CHARGE, TraceStats.DOMAIN, TraceStats.FAILURE,
+               TraceStats.BUDGET]
+    report.append('  stopped: ' + ', '.join(
+        '%s %d' % (reason, sum(1 for s in stats if s.reason == reason))
+        for reason in reasons))
+    report.append('  slowest:')
+    for s in sorted(stats, key=lambda s: s.time, reverse=True)[:worst]:
+        report.append('    ' + str(s))
+    return '\n'.join(report)
+
+def pixel_size(figsize=(6, 4.5), dpi=100, domain=None):
+    """Returns the size of a pixel, in the units of the 'domain' (see
+    get_domain()), for a plot finalized by finalize_plot() in a figure of
+    size 'figsize' (inches) and resolution 'dpi'."""
+    xmin, xmax, ymin, ymax = get_domain(domain).view()
+    return min((xmax-xmin)/(0.98*figsize[0]*dpi),
+               (ymax-ymin)/(0.98*figsize[1]*dpi))
+
+def arrowheads(fieldlines, size, startarrows=True, endarrows=True):
+    """Returns the (k, 3, 2) array of triangle vertices for the arrow heads
+    of the 'fieldlines' (see FieldLine.arrows()).  The heads are 'size'
+    long and wide."""
+    arrows = [fieldline.arrows(startarrows, endarrows)
+              for fieldline in fieldlines]
+    if not arrows:
+        return numpy.zeros((0, 3, 2))
+    x = numpy.concatenate([a[0] for a in arrows]).reshape(-1, 2)
+    dx = numpy.concatenate([a[1] for a in arrows]).reshape(-1, 2)
+    base = x + dx/100.
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        u = size*dx/norm(dx)[..., newaxis]
+    v = numpy.stack([-u[:, 1], u[:, 0]], axis=-1)/2
+    return numpy.stack([base+v, base+u, base-v], axis=1)
+
+# pylint: disable=too-many-arguments
+def plot_fieldlines(fieldlines, linewidth=None, linestyle='-',
+                    startarrows=True, endarrows=True, ax=None, artists=None):
+    """Plots the 'fieldlines' on the axes 'ax' (the current pyplot axes by
+    default) as one LineCollection, with their arrow heads as one
+    PolyCollection.  The arrows are placed as by FieldLine.plot().
+    Returns the two collections.  If the collections 'artists' of an
+    earlier call are given then they are updated in place instead."""
+    if linewidth is None:
+        linewidth = matplotlib.rcParams['lines.linewidth']
+    if artists is not None:
+        lines, heads = artists
+        lines.set_segments([fieldline.x for fieldline in fieldlines])
+        lines.set_linewidth(linewidth)
+        lines.set_linestyle(linestyle)
+        heads.set_verts(arrowheads(fieldlines, 0.1*linewidth, startarrows,
+                                   endarrows))
+        return lines, heads
+    ax = pyplot.gca() if ax is None else ax
+    lines = LineCollection([fieldline.x for fieldline in fieldlines],
+                           colors='k', linewidths=linewidth,
+                           linestyles=linestyle)
+    heads = PolyCollection(arrowheads(fieldlines, 0.1*linewidth,
+                                      startarrows, endarrows),
+                           facecolors='k', edgecolors='k')
+    ax.add_collection(lines)
+    ax.add_collection(heads)
+    return lines, heads
+
+def finalize_plot(domain=None, ax=None):
+    """Finalizes the plot of the 'domain' (see get_domain()) on the axes
+    'ax', which defaults to the current pyplot axes."""
+    xmin, xmax, ymin, ymax = get_domain(domain).view()
+    ax = pyplot.gca() if ax is None else ax
     ax.set_xticks([])
     ax.set_yticks([])
-    pyplot.xlim(XMIN/ZOOM+XOFFSET, XMAX/ZOOM+XOFFSET)
-    pyplot.ylim(YMIN/ZOOM, YMAX/ZOOM)
-    pyplot.subplots_adjust(left=0.01, right=0.99, top=0.99, bottom=0.01)
+    ax.set_xlim(xmin, xmax)
+    ax.set_ylim(ymin, ymax)
+    ax.figure.subplots_adjust(left=0.01, right=0.99, top=0.99, bottom=0.01)
 
 
 #-----------------------------------------------------------------------------
 # Classes
 
+class Domain(namedtuple('Domain', 'xmin xmax ymin ymax zoom xoffset')):
+    """An area of interest.
+
+    Field lines are traced within xmin < x < xmax and ymin < y < ymax.  The
+    plotting view is the area scaled down by 'zoom' and shifted right by
+    'xoffset'.  Domains are immutable, so fields and plots that are given
+    their own domains can be used from several threads at once.  The
+    default domain for everything else is set using init()."""
+
+    __slots__ = ()
+
+    # pylint: disable=too-many-arguments
+    def __new__(cls, xmin, xmax, ymin, ymax, zoom=1, xoffset=0):
+        """Initializes the domain."""
+        return super().__new__(cls, xmin, xmax, ymin, ymax, zoom, xoffset)
+
+    def view(self):
+        """Returns the (xmin, xmax, ymin, ymax) limits of the plotting
+        view."""
+        return (self.xmin/self.zoom + self.xoffset,
+                self.xmax/self.zoom + self.xoffset,
+                self.ymin/self.zoom, self.ymax/self.zoom)
+
+    def contains(self, x):
+        """Returns True where the point(s) x are inside the area."""
+        x = array(x, dtype=float)
+        return (self.xmin < x[..., 0]) & (x[..., 0] < self.xmax) & \
+          (self.ymin < x[..., 1]) & (x[..., 1] < self.ymax)
+
+
 class PointCharge:
     """A point charge."""
 
@@ -126,24 +727,40 @@ class PointCharge:
     def E(self, x):  # pylint: disable=invalid-name
         """Electric field vector."""
         if self.q == 0:
-            return 0
+            return zeros_like(x, dtype=float)
         dx = x-self.x
-        return (self.q*dx.T/numpy.sum(dx**2, axis=-1)**1.5).T
+        w = evaluate('q/(a**2 + b**2)**1.5', q=self.q, a=dx[..., 0],
+                     b=dx[..., 1])
+        return dx*w[..., newaxis]
 
     def V(self, x):  # pylint: disable=invalid-name
         """Potential."""
-        return self.q/norm(x-self.x)
+        dx = x-self.x
+        return evaluate('q/sqrt(a**2 + b**2)', q=self.q, a=dx[..., 0],
+                        b=dx[..., 1])[()]
 
-    def is_close(self, x):
-        """Returns True if x is close to the charge; false otherwise."""
-        return norm(x-self.x) < self.R
+    def distance(self, x):
+        """Returns the distance from x to the charge."""
+        return norm(x-self.x)
 
-    def plot(self):
-        """Plots the charge."""
+    def is_close(self, x):
+        """Returns True where the point(s) x are close to the charge; false
+        otherwise."""
+        return self.distance(x) < self.R
+
+    def plot(self, ax=None, artist=None):
+        """Plots the charge on the axes 'ax' (the current pyplot axes by
+        default).  Returns the patch.  If the patch 'artist' of an earlier
+        call is given then it is updated in place instead."""
         color = 'b' if self.q < 0 else 'r' if self.q > 0 else 'k'
         r = 0.1*(sqrt(fabs(self.q))/2 + 1)
-        circle = pyplot.Circle(self.x, r, color=color, zorder=10)
-        pyplot.gca().add_artist(circle)
+        if artist is not None:
+            artist.set_center(self.x)
+            artist.set_radius(r)
+            artist.set_color(color)
+            return artist
+        ax = pyplot.gca() if ax is None else ax
+        return ax.add_artist(Circle(self.x, r, color=color, zorder=10))
 
 
 class PointChargeFlatland(PointCharge):
@@ -153,7 +770,8 @@ class PointChargeFlatland(PointCharge):
     def E(self, x):  # pylint: disable=invalid-name
         """Electric field vector."""
         dx = x-self.x
-        return (self.q*dx.T/numpy.sum(dx**2, axis=-1)).T
+        w = evaluate('q/(a**2 + b**2)', q=self.q, a=dx[..., 0], b=dx[..., 1])
+        return dx*w[..., newaxis]
 
     def V(self, x):
         raise RuntimeError('Not implemented')
@@ -175,105 +793,1017 @@ class LineCharge:
     lam = property(get_lam)
 
     def E(self, x):  # pylint: disable=invalid-name
-        """Electric field vector.
-        Ref: http://www.phys.uri.edu/gerhard/PHY204/tsl31.pdf
-        """
-        x = array(x)
-        x1, x2, lam = self.x1, self.x2, self.lam
+        """Electric field vector."""
+        return segment_E(x, self.x1[newaxis], self.x2[newaxis],
+                         array([self.lam]))
 
-        # Get lengths and angles for the different triangles
-        theta1, theta2 = angle(x, x1, x2), pi - angle(x, x2, x1)
-        a = point_line_distance(x, x1, x2)
-        r1, r2 = norm(x - x1), norm(x - x2)
+    def distance(self, x):
+        """Returns the distance from x to the charge."""
+        return point_segment_distance(x, self.x1, self.x2)
 
-        # Calculate the parallel and perpendicular components
-        sign = where(is_left(x, x1, x2), 1, -1)
+    def is_close(self, x):
+        """Returns True where the point(s) x are close to the charge; false
+        otherwise."""
+        return self.distance(x) < self.R
 
-        # pylint: disable=invalid-name, invalid-unary-operand-type
-        Epara = lam*(1/r2-1/r1)
-        Eperp = -sign*lam*(cos(theta2)-cos(theta1))/where(a == 0, infty, a)
+    def V(self, x):  # pylint: disable=invalid-name
+        """Potential."""
+        return segment_V(x, self.x1[newaxis], self.x2[newaxis],
+                         array([self.lam]))
 
-        # Transform into the coordinate space and return
-        dx = x2 - x1
+    def plot(self, ax=None, artist=None):
+        """Plots the charge on the axes 'ax' (the current pyplot axes by
+        default).  Returns the line.  If the line 'artist' of an earlier call
+        is given then it is updated in place instead."""
+        color = 'b' if self.q < 0 else 'r' if self.q > 0 else 'k'
+        x, y = zip(self.x1, self.x2)
+        width = 5*(sqrt(fabs(self.lam))/2 + 1)
+        if artist is not None:
+            artist.set_data(x, y)
+            artist.set_linewidth(width)
+            artist.set_color(color)
+            return artist
+        ax = pyplot.gca() if ax is None else ax
+        return ax.plot(x, y, color, linewidth=width)[0]
 
-        if len(x.shape) == 2:
-            Epara = Epara[::, newaxis]
-            Eperp = Eperp[::, newaxis]
 
-        return Eperp * (array([-dx[1], dx[0]])/norm(dx)) + Epara * (dx/norm(dx))
+class ChargeSet:
+    """A packed collection of charges.
 
-    def is_close(self, x):
-        """Returns True if x is close to the charge."""
+    The positions and charges of PointCharge and PointChargeFlatland
+    instances, and the end points and densities of LineCharge instances, are
+    held in contiguous arrays and evaluated for many points at once using
+    blocked broadcast kernels.  Other charge types are evaluated one at a
+    time.  Uncharged points contribute nothing to the field, but are kept in
+    'sites' for distance calculations."""
 
-        theta1 = angle(x, self.x1, self.x2)
-        theta2 = angle(x, self.x2, self.x1)
+    maxbytes = 2**25  # The memory cap for kernel temporaries (bytes)
 
-        if theta1 < radians(90) and theta2 < radians(90):
-            return point_line_distance(x, self.x1, self.x2) < self.R
-        return numpy.min([norm(self.x1-x), norm(self.x2-x)], axis=0) < self.R
+    # The peak kernel memory for each pair of a point with a point charge or
+    # segment (bytes), measured with tracemalloc plus some headroom
+    pointbytes, segmentbytes = 64, 96
+
+    def __init__(self, charges):
+        """Packs 'charges'."""
+        self.charges = list(charges)
+        kinds = (PointCharge, PointChargeFlatland)
+        # pylint: disable=unidiomatic-typecheck
+        points = [c for c in self.charges if type(c) in kinds]
+        self.sites = array([c.x for c in points], dtype=float).reshape(-1, 2)
+        packed = [c for c in points if c.q != 0]
+        self.segments = [c for c in self.charges if type(c) is LineCharge]
+        self.others = [c for c in self.charges
+                       if type(c) not in kinds + (LineCharge,)]
+        self.x = array([c.x for c in packed], dtype=float).reshape(-1, 2)
+        self.q = array([c.q for c in packed], dtype=float)
+        self.flatland = array([type(c) is PointChargeFlatland for c in packed],
+                              dtype=bool)
+        self.x1 = array([c.x1 for c in self.segments],
+                        dtype=float).reshape(-1, 2)
+        self.x2 = array([c.x2 for c in self.segments],
+                        dtype=float).reshape(-1, 2)
+        self.lam = array([c.lam for c in self.segments], dtype=float)
+
+        # The indices of each point charge in the sites and packed arrays
+        # (None if it is uncharged), and of each segment, for update()
+        rank = {id(c): j for j, c in enumerate(packed)}
+        self.slots = {id(c): (i, rank.get(id(c)))
+                      for i, c in enumerate(points)}
+        self.slots.update({id(c): (i, 'segment')
+                           for i, c in enumerate(self.segments)})
+
+    def update(self, charge):
+        """Updates the packed arrays after one of the charges has been
+        modified.  Returns False, leaving the arrays as they were, if the
+        charge cannot be updated in place (e.g., it is not packed, or its
+        charge has become or stopped being zero) and must be repacked with
+        the others instead."""
+        if id(charge) not in self.slots:
+            return False
+        i, j = self.slots[id(charge)]
+        if j == 'segment':
+            self.x1[i], self.x2[i], self.lam[i] = \
+              charge.x1, charge.x2, charge.lam
+        elif (j is None) == (charge.q == 0):
+            self.sites[i] = charge.x
+            if j is not None:
+                self.x[j], self.q[j] = charge.x, charge.q
+        else:
+            return False
+        return True
+
+    def blocks(self, m):
+        """Yields (start, stop) slices that divide m points into blocks
+        whose kernel temporaries respect the memory cap."""
+        n = self.pointbytes*len(self.sites) + self.segmentbytes*len(self.lam)
+        size = max(1, self.maxbytes // max(1, n))
+        for start in range(0, m, size):
+            yield start, min(start+size, m)
+
+    def subset(self, mask):
+        """Returns a ChargeSet holding only the packed point charges selected
+        by the boolean 'mask'."""
+        chargeset = ChargeSet([])
+        chargeset.x, chargeset.q = self.x[mask], self.q[mask]
+        chargeset.flatland = self.flatland[mask]
+        chargeset.sites = chargeset.x
+        return chargeset
+
+    def other_E(self, points):  # pylint: disable=invalid-name
+        """Returns the electric field of the line segments and other charges
+        at the (N, 2) array of 'points'."""
+        e = zeros_like(points)
+        if len(self.lam):
+            for start, stop in self.blocks(len(points)):
+                e[start:stop] = segment_E(points[start:stop], self.x1, self.x2,
+                                          self.lam)
+        for charge in self.others:
+            e += charge.E(points)
+        return e
+
+    def other_V(self, points):  # pylint: disable=invalid-name
+        """Returns the potential of the line segments and other charges at
+        the (N, 2) array of 'points'."""
+        v = numpy.zeros(len(points))
+        if len(self.lam):
+            for start, stop in self.blocks(len(points)):
+                v[start:stop] = segment_V(points[start:stop], self.x1, self.x2,
+                                          self.lam)
+        for charge in self.others:
+            v += charge.V(points)
+        return v
+
+    def point_E(self, points):  # pylint: disable=invalid-name
+        """Returns the electric field of the packed point charges at the
+        (N, 2) array of 'points'."""
+        e = zeros_like(points)
+        for start, stop in self.blocks(len(points)):
+            a = evaluate('x - x0', x=points[start:stop, 0, newaxis],
+                         x0=self.x[:, 0])
+            b = evaluate('y - y0', y=points[start:stop, 1, newaxis],
+                         y0=self.x[:, 1])
+            w = evaluate('q/where(flatland, a**2 + b**2, (a**2 + b**2)**1.5)',
+                         q=self.q, flatland=self.flatland, a=a, b=b)
+            e[start:stop, 0] = numpy.sum(evaluate('w*a', w=w, a=a), axis=-1)
+            e[start:stop, 1] = numpy.sum(evaluate('w*b', w=w, b=b), axis=-1)
+        return e
+
+    def point_V(self, points):  # pylint: disable=invalid-name
+        """Returns the potential of the packed point charges at the (N, 2)
+        array of 'points'."""
+        v = numpy.zeros(len(points))
+        for start, stop in self.blocks(len(points)):
+            v[start:stop] = numpy.sum(
+                evaluate('q/sqrt((x - x0)**2 + (y - y0)**2)', q=self.q,
+                         x=points[start:stop, 0, newaxis], x0=self.x[:, 0],
+                         y=points[start:stop, 1, newaxis], y0=self.x[:, 1]),
+                axis=-1)
+        return v
+
+    def E(self, x):  # pylint: disable=invalid-name
+        """Electric field vector at the point(s) x."""
+        x = array(x, dtype=float)
+        points = x.reshape(-1, 2)
+        e = self.point_E(points) + self.other_E(points)
+        return e.reshape(x.shape)
 
     def V(self, x):  # pylint: disable=invalid-name
-        """Potential.
-        Ref: https://aapt.scitation.org/doi/pdf/10.1119/1.2348889
-        """
-        r1 = norm(x-self.x1)
-        r2 = norm(x-self.x2)
-        L = norm(self.x2-self.x1)  # pylint: disable=invalid-name
-        return self.lam*numpy.log((r1+r2+L)/(r1+r2-L))
+        """Potential at the point(s) x."""
+        if self.flatland.any():
+            raise RuntimeError('Not implemented')
+        x = array(x, dtype=float)
+        points = x.reshape(-1, 2)
+        v = self.point_V(points) + self.other_V(points)
+        return v.reshape(x.shape[:-1])[()]
+
+    def distance(self, x):
+        """Returns the distance from the point(s) x to the nearest charge."""
+        x = array(x, dtype=float)
+        points = x.reshape(-1, 2)
+        d = numpy.full(len(points), numpy.inf)
+        for start, stop in self.blocks(len(points)):
+            if len(self.sites):
+                dx = points[start:stop, newaxis, :] - self.sites
+                d[start:stop] = numpy.min(norm(dx), axis=-1)
+            if len(self.lam):
+                r = points[start:stop, newaxis, :] - self.x1
+                dx = self.x2 - self.x1
+                t = numpy.clip(numpy.sum(r*dx, axis=-1) /
+                               numpy.sum(dx**2, axis=-1), 0, 1)
+                d[start:stop] = numpy.minimum(
+                    d[start:stop],
+                    numpy.min(norm(r - t[..., newaxis]*dx), axis=-1))
+        for charge in self.others:
+            d = numpy.minimum(d, charge.distance(points))
+        return d.reshape(x.shape[:-1])[()]
+
+
+class BarnesHut(ChargeSet):
+    """A packed collection of charges evaluated using Barnes-Hut quadtrees.
+
+    The point charges are sorted into a quadtree for each field kernel
+    (PointCharge and PointChargeFlatland).  Each node stores the monopole
+    and dipole moments of its charges about the node centre.  A node whose
+    width is less than 'theta' times its distance from an evaluation point
+    is treated as a multipole; otherwise its children (or, for a leaf, its
+    charges) are visited.  The relative error of the approximation falls off
+    as theta**2, and the cost of evaluating M points is O(M log N).
+
+    The tree walk is vectorized over all pairs of points and nodes at each
+    level of the tree.  Other charge types are evaluated directly."""
+
+    leafsize = 8  # The maximum number of charges in a leaf node
+    blocksize = 4096  # The number of points walked through the tree at once
+
+    def __init__(self, charges, theta=0.3):
+        """Packs 'charges' into quadtrees with opening angle 'theta'."""
+        ChargeSet.__init__(self, charges)
+        self.theta = theta
+        self.trees = [self.build(self.x[self.flatland == flatland],
+                                 self.q[self.flatland == flatland])
+                      for flatland in [False, True]]
+
+    def update(self, charge):
+        """Updates the packed arrays and rebuilds the trees after one of the
+        charges has been modified (see ChargeSet.update())."""
+        if not ChargeSet.update(self, charge):
+            return False
+        self.trees = [self.build(self.x[self.flatland == flatland],
+                                 self.q[self.flatland == flatland])
+                      for flatland in [False, True]]
+        return True
+
+    def build(self, x, q):
+        """Returns a dict of node arrays for the quadtree of the charges 'q'
+        at positions 'x'."""
+
+        # Each node is a (indices, center, halfwidth) entry in the queue.
+        # The root node bounds the charges; an empty tree has a single,
+        # empty root at the origin.
+        if len(x):
+            lo, hi = x.min(axis=0), x.max(axis=0)
+        else:
+            lo, hi = numpy.zeros(2), numpy.zeros(2)
+        queue = [(arange(len(x)), (lo+hi)/2, max((hi-lo).max()/2, 1.e-12))]
+        children, order, ranges = [], [], []
+
+        # Split nodes breadth first
+        for indices, center, half in queue:
+            kids = [-1]*4
+            start = len(order)
+            if len(indices) <= self.leafsize or half < 1.e-9:
+                order.extend(indices)
+            else:
+                quadrant = (x[indices, 0] > center[0]) + \
+                  2*(x[indices, 1] > center[1])
+                for i in range(4):
+                    sub = indices[quadrant == i]
+                    if len(sub):
+                        kids[i] = len(queue)
+                        offset = array([i%2, i//2])*2 - 1
+                        queue.append((sub, center + offset*half/2, half/2))
+            children.append(kids)
+            ranges.append((start, len(order)))
+
+        center = array([node[1] for node in queue]).reshape(-1, 2)
+        return {
+            'x': x[order], 'q': q[order],
+            'center': center,
+            'width': 2*array([node[2] for node in queue]),
+            'Q': array([q[node[0]].sum() for node in queue]),
+            'P': array([numpy.dot(q[node[0]], x[node[0]]-c)
+                        for node, c in zip(queue, center)]).reshape(-1, 2),
+            'children': array(children, dtype=int).reshape(-1, 4),
+            'ranges': array(ranges, dtype=int).reshape(-1, 2)
+        }
+
+    # pylint: disable=too-many-locals
+    def walk(self, tree, points, flatland, potential):
+        """Returns the field (or 'potential') of 'tree' at 'points'.  The
+        'flatland' flag selects the kernel."""
+
+        m = len(points)
+        result = numpy.zeros(m if potential else (m, 2))
+        if not len(tree['q']):
+            return result
+
+        def add(i, values):
+            """Accumulates values for the point indices i."""
+            if potential:
+                result[:] += numpy.bincount(i, values, m)
+            else:
+                result[:, 0] += numpy.bincount(i, values[:, 0], m)
+                result[:, 1] += numpy.bincount(i, values[:, 1], m)
+
+        # Pairs of point and node indices, starting at the root
+        i, k = arange(m), numpy.zeros(m, dtype=int)
+
+        while len(i):
+
+            # Use multipoles for nodes that are far enough away
+            d = points[i] - tree['center'][k]
+            r2 = numpy.sum(d**2, axis=-1)
+            far = tree['width'][k]**2 < self.theta**2*r2
+            Q, P, d, r2 = tree['Q'][k[far]], tree['P'][k[far]], d[far], r2[far]
+            Pd = numpy.sum(P*d, axis=-1)
+            if potential:
+                add(i[far], Q/sqrt(r2) + Pd/r2**1.5)
+            else:
+                # Monopole and dipole fields for the 1/r**2 (3D) or 1/r
+                # (Flatland) kernels
+                n, r = (2, r2) if flatland else (3, r2**1.5)
+                add(i[far], ((Q + n*Pd/r2)/r)[:, newaxis]*d -
+                    P/r[:, newaxis])
+            i, k = i[~far], k[~far]
+
+            # Sum directly over the charges in leaf nodes
+            leaf = (tree['children'][k] < 0).all(axis=-1)
+            start, stop = tree['ranges'][k[leaf]].T
+            counts = stop - start
+            j = numpy.repeat(start-cumsum(counts)+counts, counts) + \
+              arange(counts.sum())
+            p = numpy.repeat(i[leaf], counts)
+            dx = points[p] - tree['x'][j]
+            r2 = numpy.sum(dx**2, axis=-1)
+            if potential:
+                add(p, tree['q'][j]/sqrt(r2))
+            else:
+                add(p, (tree['q'][j]/(r2 if flatland else r2**1.5))[:, newaxis]
+                    *dx)
+
+            # Descend into the children of the other nodes
+            i, k = i[~leaf], tree['children'][k[~leaf]]
+            i, k = numpy.repeat(i, 4)[k.ravel() >= 0], k[k >= 0]
+
+        return result
+
+    def point_E(self, points):  # pylint: disable=invalid-name
+        e = zeros_like(points)
+        for start in range(0, len(points), self.blocksize):
+            block = points[start:start+self.blocksize]
+            for tree, flatland in zip(self.trees, [False, True]):
+                e[start:start+len(block)] += \
+                  self.walk(tree, block, flatland, potential=False)
+        return e
+
+    def point_V(self, points):  # pylint: disable=invalid-name
+        v = numpy.zeros(len(points))
+        for start in range(0, len(points), self.blocksize):
+            block = points[start:start+self.blocksize]
+            v[start:start+len(block)] = \
+              self.walk(self.trees[0], block, False, potential=True)
+        return v
+
+
+class ParticleMesh:
+    """A particle-mesh solver for fields and potentials on a uniform grid.
+
+    Point charges are deposited onto the grid nodes using cloud-in-cell
+    weights and convolved with the Green's function of the 3D or Flatland
+    kernel using FFTs.  The field is found by convolving with the gradient
+    of the Green's function.  Within 'near' cells of each charge the mesh
+    contribution is replaced by the exact one, so results match direct
+    summation close to charges.  Elsewhere the error falls off as the
+    square of the grid spacing over the distance to the charges.
+
+    Charges that lie off the grid and other charge types are summed
+    directly."""
+
+    near = 6  # The radius of the near-field correction (cells)
+
+    def __init__(self, x, y):
+        """Initializes the mesh with uniformly spaced node coordinates 'x'
+        and 'y'."""
+        self.x, self.y = array(x, dtype=float), array(y, dtype=float)
+        assert len(self.x) > 1 and len(self.y) > 1
+        self.h = array([self.x[1]-self.x[0], self.y[1]-self.y[0]])
+
+    @staticmethod
+    def green(dx, flatland, potential, exact=False):
+        """Returns the Green's function (or its gradient) components for the
+        displacements dx.  Terms at zero displacement are zero unless the
+        'exact' (singular) values are wanted."""
+        r2 = numpy.sum(dx**2, axis=-1)
+        if not exact:
+            r2 = where(r2 == 0, numpy.inf, r2)
+        if potential:
+            return [1/sqrt(r2)]
+        r = r2 if flatland else r2**1.5
+        return [dx[..., 0]/r, dx[..., 1]/r]
+
+    # pylint: disable=too-many-locals
+    def solve(self, chargeset, potential=False):
+        """Returns the field (ny, nx, 2) or 'potential' (ny, nx) owing to
+        the charges in 'chargeset' at the mesh nodes."""
+
+        if potential and chargeset.flatland.any():
+            raise RuntimeError('Not implemented')
+
+        nx, ny = len(self.x), len(self.y)
+        origin = array([self.x[0], self.y[0]])
+        nodes = numpy.stack(meshgrid(self.x, self.y), axis=-1).reshape(-1, 2)
+        ncomp = 1 if potential else 2
+        result = numpy.zeros((ncomp, ny*nx))
+
+        # Cells holding each charge, and its offset within the cell
+        f = (chargeset.x - origin)/self.h
+        ij = numpy.clip(numpy.floor(f).astype(int), 0, [nx-2, ny-2])
+        t = f - ij
+        inside = ((t >= 0) & (t <= 1)).all(axis=-1)
+
+        # Sum off-grid charges directly
+        outside = chargeset.subset(~inside)
+        if potential:
+            result += outside.point_V(nodes)
+        else:
+            result += outside.point_E(nodes).T
+
+        # Displacements of the mesh Green's functions
+        offsets = numpy.stack(meshgrid(arange(-(nx-1), nx)*self.h[0],
+                                       arange(-(ny-1), ny)*self.h[1]),
+                              axis=-1)
+
+        # The four cloud-in-cell corners and weights for each charge
+        corners = array([[0, 0], [1, 0], [0, 1], [1, 1]])
+        weights = numpy.stack([(1-t[:, 0])*(1-t[:, 1]), t[:, 0]*(1-t[:, 1]),
+                               (1-t[:, 0])*t[:, 1], t[:, 0]*t[:, 1]], axis=-1)
+
+        # Window of nodes around each charge for the near-field correction
+        w = arange(-self.near, self.near+2)
+        window = numpy.stack(meshgrid(w, w), axis=-1).reshape(-1, 2)
+
+        for flatland in [False, True]:
+            mask = inside & (chargeset.flatland == flatland)
+            if not mask.any():
+                continue
+            x, q, ij_, weights_ = \
+              chargeset.x[mask], chargeset.q[mask], ij[mask], weights[mask]
+
+            # Deposit the charges onto the mesh and convolve
+            cells = ij_[:, newaxis, :] + corners
+            rho = numpy.bincount((cells[..., 1]*nx + cells[..., 0]).ravel(),
+                                 (q[:, newaxis]*weights_).ravel(), nx*ny)
+            rho = rho.reshape(ny, nx)
+            for k, g in enumerate(self.green(offsets, flatland, potential)):
+                result[k] += fftconvolve(g, rho, mode='valid').ravel()
+
+            # Replace the mesh contribution near each charge with the exact one
+            n = ij_[:, newaxis, :] + window
+            ok = ((n >= 0) & (n < [nx, ny])).all(axis=-1)
+            n = numpy.where(ok[..., newaxis], n, 0)
+            xn = origin + n*self.h
+            exact = self.green(xn - x[:, newaxis, :], flatland, potential,
+                               exact=True)
+            mesh = [0]*ncomp
+            for c in range(4):
+                dxc = xn - (origin + cells[:, c, newaxis, :]*self.h)
+                for k, g in enumerate(self.green(dxc, flatland, potential)):
+                    mesh[k] += weights_[:, c, newaxis]*g
+            index = (n[..., 1]*nx + n[..., 0])[ok]
+            for k in range(ncomp):
+                correction = (q[:, newaxis]*(exact[k] - mesh[k]))[ok]
+                result[k] += numpy.bincount(index, correction, nx*ny)
+
+        # Add the other charges
+        if potential:
+            result += chargeset.other_V(nodes)
+        else:
+            result += chargeset.other_E(nodes).T
+
+        if potential:
+            return result[0].reshape(ny, nx)
+        return result.T.reshape(ny, nx, 2)
+
+
+class ChargeIndex:
+    """A spatial index over charges for proximity tests.
+
+    The plane is divided into a uniform grid of cells.  Each charge is
+    registered in the cells that come within its effective radius R, so a
+    query only needs to examine the few charges listed for the cell that a
+    point falls in."""
+
+    def __init__(self, charges, cellsize=None):
+        """Indexes 'charges'.  The 'cellsize' defaults to twice the largest
+        effective radius."""
+        self.charges = list(charges)
+        self.cellsize = cellsize if cellsize else \
+          2*max([c.R for c in self.charges], default=PointCharge.R)
+        h = self.cellsize
+
+        # Represent each charge by a segment (points have zero length) and
+        # sample the segments at spacings of no more than h/2
+        ends = numpy.array([[c.x1, c.x2] if isinstance(c, LineCharge) else
+                            [c.x, c.x] for c in self.charges],
+                           dtype=float).reshape(-1, 2, 2)
+        r = array([c.R for c in self.charges], dtype=float)
+        m = numpy.ceil(norm(ends[:, 1]-ends[:, 0])/(h/2)).astype(int) + 1
+        ids = numpy.repeat(arange(len(m)), m)
+        t = (arange(m.sum()) - numpy.repeat(cumsum(m)-m, m)) / \
+          numpy.maximum(m-1, 1)[ids]
+        x1, x2 = ends[ids, 0], ends[ids, 1]
+        samples = x1 + t[:, newaxis]*(x2-x1)
+
+        # Get the cells about each sample that come within reach of it
+        reach = r[ids] + h/4
+        w = int(numpy.ceil(2*reach.max()/h)) + 1 if len(ids) else 0
+        lo = numpy.floor((samples - reach[:, newaxis])/h).astype(numpy.int64)
+        hi = numpy.floor((samples + reach[:, newaxis])/h).astype(numpy.int64)
+        di, dj = [a.ravel() for a in meshgrid(arange(w), arange(w))]
+        i, j = lo[:, :1] + di, lo[:, 1:] + dj
+        ok = (i <= hi[:, :1]) & (j <= hi[:, 1:])
+        ids = numpy.broadcast_to(ids[:, newaxis], ok.shape)[ok]
+        i, j, x1, x2 = i[ok], j[ok], ends[ids, 0], ends[ids, 1]
+
+        # Keep the cells that actually come within reach of their charge
+        centers = (numpy.stack([i, j], axis=-1) + 0.5)*h
+        dx = x2 - x1
+        t = numpy.clip(((centers-x1)*dx).sum(axis=-1) /
+                       numpy.maximum((dx*dx).sum(axis=-1), 1e-300), 0, 1)
+        near = norm(centers - x1 - t[:, newaxis]*dx) <= r[ids] + h/sqrt(2)
+        keys, ids = self._key(i[near], j[near]), ids[near]
+
+        # Sort the cell entries into contiguous runs for each key, dropping
+        # the duplicates found from neighbouring samples
+        order = numpy.lexsort((ids, keys))
+        keys, ids = keys[order], ids[order]
+        first = numpy.ones(len(keys), dtype=bool)
+        first[1:] = (keys[1:] != keys[:-1]) | (ids[1:] != ids[:-1])
+        keys, ids = keys[first], ids[first]
+        self.keys, counts = numpy.unique(keys, return_counts=True)
+        self.ids = ids
+        self.offsets = insert(cumsum(counts), 0, 0)
+
+    @staticmethod
+    def _key(i, j):
+        """Returns the keys for cells with indices i and j."""
+        return i*2**32 + j
+
+    def query(self, x):
+        """Returns the index of the first charge that each of the point(s) x
+        is close to, or -1 where there is none."""
+        x = array(x, dtype=float)
+        points = x.reshape(-1, 2)
+        result = numpy.full(len(points), -1)
+
+        if len(self.keys):
+
+            # Find the points that fall in occupied cells
+            ij = numpy.floor(points/self.cellsize).astype(numpy.int64)
+            key = self._key(ij[:, 0], ij[:, 1])
+            pos = numpy.minimum(numpy.searchsorted(self.keys, key),
+                                len(self.keys)-1)
+            hits = numpy.flatnonzero(self.keys[pos] == key)
+
+            # Pair each of those points with the charges listed for its cell
+            start, stop = self.offsets[pos[hits]], self.offsets[pos[hits]+1]
+            counts = stop - start
+            p = numpy.repeat(hits, counts)
+            candidates = self.ids[numpy.repeat(start-cumsum(counts)+counts,
+                                               counts) + arange(counts.sum())]
+
+            # Check the distance to each candidate charge
+            for k in numpy.unique(candidates):
+                c, i = self.charges[k], p[candidates == k]
+                i = i[(c.distance(points[i]) < c.R) & (result[i] < 0)]
+                result[i] = k
+
+        return result.reshape(x.shape[:-1])[()]
 
-    def plot(self):
-        """Plots the charge."""
-        color = 'b' if self.q < 0 else 'r' if self.q > 0 else 'k'
-        x, y = zip(self.x1, self.x2)
-        width = 5*(sqrt(fabs(self.lam))/2 + 1)
-        pyplot.plot(x, y, color, linewidth=width)
+    def is_close(self, x):
+        """Returns True where the point(s) x are close to any charge."""
+        return self.query(x) >= 0
 
 
 # pylint: disable=too-few-public-methods
-class FieldLine:
-    """A Field Line."""
+class TraceStats:
+    """Statistics for tracing one direction of a field line.
+
+    The attributes are the seed 'x0', the 'direction' (1 forward or -1
+    backward), the number of 'steps', the number of field evaluations
+    'nfev', the wall 'time' in seconds, and the 'reason' that tracing
+    stopped.  The reason is one of CHARGE (the index of the charge that was
+    reached is given by 'charge'), DOMAIN (the line left the area of
+    interest), FAILURE (the integrator failed, e.g., at a zero-field point)
+    or BUDGET (the step budget ran out)."""
+
+    CHARGE, DOMAIN, FAILURE, BUDGET = 'charge', 'domain', 'failure', 'budget'
+
+    __slots__ = ('x0', 'direction', 'steps', 'nfev', 'time', 'reason',
+                 'charge')
+
+    # pylint: disable=too-many-arguments, redefined-outer-name
+    def __init__(self, x0, direction, steps=0, nfev=0, time=0., reason=None,
+                 charge=None):
+        """Initializes the statistics."""
+        self.x0, self.direction = array(x0, dtype=float), direction
+        self.steps, self.nfev, self.time = steps, nfev, time
+        self.reason, self.charge = reason, charge
+
+    def __str__(self):
+        reason = self.reason if self.charge is None else \
+          '%s %d' % (self.reason, self.charge)
+        return '(%g, %g) %s: %d steps, %d evaluations, %.3g s, %s' % \
+          (self.x0[0], self.x0[1],
+           'forward' if self.direction > 0 else 'backward',
+           self.steps, self.nfev, self.time, reason)
 
-    def __init__(self, x):
-        "Initializes the field line points 'x'."""
-        self.x = x
 
-    def plot(self, linewidth=None, linestyle='-',
-             startarrows=True, endarrows=True):
-        """Plots the field line and arrows."""
+# pylint: disable=too-few-public-methods
+class FieldLine:
+    """A Field Line.
 
-        if linewidth is None:
-            linewidth = matplotlib.rcParams['lines.linewidth']
+    The points are held in one contiguous float array with free space at
+    both ends, so that a line can be grown in either direction in amortized
+    constant time while it is traced.  Traced lines carry a pair of
+    TraceStats for the forward and backward directions in 'stats'."""
 
-        x, y = zip(*self.x)
-        pyplot.plot(x, y, '-k', linewidth=linewidth, linestyle=linestyle)
+    __slots__ = ('_buf', '_start', '_stop', '_arrows', 'stats')
 
+    def __init__(self, x, stats=None):
+        "Initializes the field line points 'x' and tracing 'stats'."""
+        self.x = x
+        self.stats = stats
+
+    def get_x(self):
+        """Returns the (n, 2) array of field line points."""
+        return self._buf[self._start:self._stop]
+
+    def set_x(self, x):
+        """Sets the field line points."""
+        self._buf = numpy.array(x, dtype=float).reshape(-1, 2)
+        self._start, self._stop = 0, len(self._buf)
+        self._arrows = None
+
+    x = property(get_x, set_x)
+
+    def __len__(self):
+        return self._stop - self._start
+
+    def _grow(self, front):
+        """Reallocates the buffer with extra room at the front or back."""
+        n = len(self)
+        extra = max(n, 16)
+        head = self._start + (extra if front else 0)
+        tail = len(self._buf) - self._stop + (0 if front else extra)
+        buf = numpy.empty((head+n+tail, 2))
+        buf[head:head+n] = self.x
+        self._buf, self._start, self._stop = buf, head, head+n
+
+    def append(self, point):
+        """Adds a point to the end of the line."""
+        if self._stop == len(self._buf):
+            self._grow(front=False)
+        self._buf[self._stop] = point
+        self._stop += 1
+        self._arrows = None
+
+    def prepend(self, point):
+        """Adds a point to the start of the line."""
+        if self._start == 0:
+            self._grow(front=True)
+        self._start -= 1
+        self._buf[self._start] = point
+        self._arrows = None
+
+    def trim(self):
+        """Releases the free space at the ends of the buffer."""
+        self.x = self.x
+
+    def _arrowpoints(self):
+        """Returns the positions, directions and end-arrow flags of all of
+        the arrows along the line."""
+        x = self.x
         n = int(len(x)/2) if len(x) < 225 else 75
-        if startarrows:
-            pyplot.arrow(x[n], y[n], (x[n+1]-x[n])/100., (y[n+1]-y[n])/100.,
-                         fc="k", ec="k",
-                         head_width=0.1*linewidth, head_length=0.1*linewidth)
+        indices = ([n] if len(x) > 2 else []) + \
+          ([len(x)-n] if len(x) >= 225 else [])
+        indices = array(indices, dtype=int)
+        return x[indices], x[indices+1] - x[indices], \
+          arange(len(indices)) == 1
+
+    def arrows(self, startarrows=True, endarrows=True):
+        """Returns the (k, 2) arrays of positions and directions of the
+        arrows along the line.  The start arrow is at the middle of short
+        lines and 75 points in from the start of long ones; long lines get
+        an end arrow 75 points in from the end as well.  The arrows of a
+        simplified line are those of the line as traced."""
+        x, dx, end = self._arrowpoints() if self._arrows is None \
+          else self._arrows
+        keep = where(end, endarrows, startarrows)
+        return x[keep], dx[keep]
+
+    def simplify(self, tol):
+        """Removes the points that are within 'tol' of the line through
+        the points kept on either side (Ramer-Douglas-Peucker).  The ends
+        and the arrows are kept.  A tenth of a pixel_size() leaves the
+        plotted line visually unchanged.  Returns the line."""
+        x = self.x
+        if len(x) < 3:
+            return self
+        arrows = self._arrowpoints() if self._arrows is None \
+          else self._arrows
+        keep = numpy.zeros(len(x), dtype=bool)
+        keep[[0, -1]] = True
+        stack = [(0, len(x)-1)]
+        while stack:
+            i, j = stack.pop()
+            if j-i < 2:
+                continue
+            y, dx = x[i+1:j] - x[i], x[j] - x[i]
+            t = numpy.clip(dot(y, dx)/dot(dx, dx), 0, 1) if dx.any() else 0
+            d = norm(y - array(t)[..., newaxis]*dx)
+            k = numpy.argmax(d)
+            if d[k] > tol:
+                k += i+1
+                keep[k] = True
+                stack.extend([(i, k), (k, j)])
+        self.x = x[keep]
+        self._arrows = arrows
+        return self
+
+    # pylint: disable=too-many-arguments
+    def plot(self, linewidth=None, linestyle='-',
+             startarrows=True, endarrows=True, ax=None):
+        """Plots the field line and arrows on the axes 'ax' (the current
+        pyplot axes by default).  Returns a list of the artists.  Use
+        plot_fieldlines() to plot many lines at once."""
 
-        if len(x) < 225 or not endarrows:
-            return
+        if linewidth is None:
+            linewidth = matplotlib.rcParams['lines.linewidth']
+        ax = pyplot.gca() if ax is None else ax
+
+        x, y = self.x.T
+        artists = ax.plot(x, y, '-k', linewidth=linewidth,
+                          linestyle=linestyle)
+
+        for (x0, y0), (dx, dy) in zip(*self.arrows(startarrows, endarrows)):
+            artists.append(
+                ax.arrow(x0, y0, dx/100., dy/100., fc="k", ec="k",
+                         head_width=0.1*linewidth, head_length=0.1*linewidth))
+        return artists
+
+
+class GridCache:
+    """An in-memory least-recently-used cache of sampled grids.
+
+    Grids are tuples of arrays stored under content-addressed keys (see
+    fingerprint()).  The arrays are made read-only so that cached grids
+    cannot be modified by their users.  The least recently used grids are
+    evicted once the stored arrays exceed 'maxbytes'.  The cache may be
+    shared between threads."""
+
+    def __init__(self, maxbytes=2**27):
+        """Initializes an empty cache holding up to 'maxbytes' of arrays."""
+        self.maxbytes = maxbytes
+        self.grids = OrderedDict()
+        self.nbytes = 0
+        self.hits, self.misses = 0, 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """Returns the grid stored under 'key', or None if there is none."""
+        with self.lock:
+            grid = self.grids.get(key)
+            if grid is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.grids.move_to_end(key)
+            return grid
+
+    def put(self, key, grid):
+        """Stores the tuple of arrays 'grid' under 'key' and returns it."""
+        for a in grid:
+            a.flags.writeable = False
+        size = sum(a.nbytes for a in grid)
+        with self.lock:
+            if key in self.grids:
+                self.nbytes -= sum(a.nbytes for a in self.grids.pop(key))
+            if size <= self.maxbytes:
+                self.grids[key] = grid
+                self.nbytes += size
+                while self.nbytes > self.maxbytes:
+                    _, old = self.grids.popitem(last=False)
+                    self.nbytes -= sum(a.nbytes for a in old)
+        return grid
+
+    def clear(self):
+        """Empties the cache and resets the counters."""
+        with self.lock:
+            self.grids.clear()
+            self.nbytes = 0
+            self.hits, self.misses = 0, 0
+
+
+# The cache shared by the sample_grid() methods
+GRIDCACHE = GridCache()
+
+
+class DiskCache:
+    """A persistent, content-addressed cache of arrays in a directory.
+
+    Entries are tuples of arrays stored in .npz files named by their keys
+    (see fingerprint()), so they are shared between processes and runs.
+    Each file is written under a temporary name and renamed into place, so
+    concurrent writers never expose partial entries.  Reading an entry
+    touches its file.  The size of the directory is estimated from a scan
+    on the first put() plus the sizes of the files written since; once it
+    exceeds 'maxbytes' the directory is scanned again and the least
+    recently used files are deleted until it is within 3/4 of the limit,
+    so that a full cache is not scanned on every put().  The interface is
+    that of GridCache, and DiskCache instances may be passed as the 'cache'
+    arguments of sample_grid(), line() and lines()."""
+
+    def __init__(self, path, maxbytes=2**30):
+        """Initializes the cache in the directory 'path', which is created
+        if needed."""
+        self.path = path
+        self.maxbytes = maxbytes
+        self.nbytes = None  # The estimated size, until the first scan
+        self.hits, self.misses = 0, 0
+        os.makedirs(path, exist_ok=True)
+
+    def get(self, key):
+        """Returns the arrays stored under 'key', or None if there are
+        none."""
+        path = os.path.join(self.path, key + '.npz')
+        try:
+            with numpy.load(path) as data:
+                grid = tuple(data['arr_%d' % i] for i in range(len(data.files)))
+            os.utime(path)
+        except (OSError, ValueError, zipfile.BadZipFile):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return grid
+
+    def put(self, key, grid):
+        """Stores the tuple of arrays 'grid' under 'key' and returns it."""
+        fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=self.path)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                numpy.savez(f, *grid)
+                size = f.tell()
+            os.replace(tmp, os.path.join(self.path, key + '.npz'))
+        except BaseException:
+            os.remove(tmp)
+            raise
+        if self.nbytes is None:
+            self.evict()
+        else:
+            self.nbytes += size
+            if self.nbytes > self.maxbytes:
+                self.evict(3*self.maxbytes//4)
+        return grid
+
+    def evict(self, maxbytes=None):
+        """Deletes the least recently used entries until the cache fits in
+        'maxbytes', which defaults to the cache's limit.  The estimated size
+        is reset from the scan."""
+        maxbytes = self.maxbytes if maxbytes is None else maxbytes
+        entries = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.endswith('.npz'):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:  # Evicted by another process
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        nbytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if nbytes <= maxbytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            nbytes -= size
+        self.nbytes = nbytes
+
+    def clear(self):
+        """Deletes all entries and resets the counters."""
+        self.evict(-1)
+        self.hits, self.misses = 0, 0
+
+
+class ChargeField:
+    """The base class for fields owing to a collection of charges.
+
+    The charges are packed into a ChargeSet for evaluation.  Tracing lines
+    and sampling grids repack them if they have been modified (see
+    packed()); the evaluation methods use the charges as they were last
+    packed, so call refresh() after modifying them."""
+
+    def __init__(self, charges, theta=None, domain=None):
+        """Initializes the field given 'charges'.  If an opening angle 'theta'
+        is given then point charges are evaluated approximately using a
+        BarnesHut tree instead of a ChargeSet.  Lines are traced and grids
+        sampled over the 'domain', which defaults to the one set using
+        init()."""
+        self.charges = charges
+        self.theta = theta
+        self.domain = domain
+        self.refresh()
+
+    def refresh(self):
+        """Repacks the charges after they have been modified."""
+        self.chargeset = ChargeSet(self.charges) if self.theta is None else \
+          BarnesHut(self.charges, self.theta)
+        self._state = [charge_state(c) for c in self.charges]
+        self._digests = [fingerprint(c) for c in self.charges]
+        self.key = fingerprint(''.join(self._digests), self.theta)
+
+    def packed(self):
+        """Returns the ChargeSet, first repacking the charges if any of them
+        have been modified, added or removed since they were packed.  This
+        checks every charge, so it is called once per line, lines() or grid
+        rather than once per evaluation."""
+        if [charge_state(c) for c in self.charges] != self._state:
+            self.refresh()
+        return self.chargeset
 
-        pyplot.arrow(x[-n], y[-n],
-                     (x[-n+1]-x[-n])/100., (y[-n+1]-y[-n])/100.,
-                     fc="k", ec="k",
-                     head_width=0.1*linewidth, head_length=0.1*linewidth)
+    def magnitude(self, x):
+        """Returns the magnitude of the field at the point(s) x."""
+        raise NotImplementedError
+
+    def solve(self, mesh):
+        """Returns the magnitude of the field on the nodes of the
+        ParticleMesh 'mesh'."""
+        raise NotImplementedError
+
+    def sample_grid(self, resolution=200, method='direct', cache=True):
+        """Returns x, y and the field magnitude z sampled over the plotting
+        view.  The whole grid is evaluated in a single batched call.  The
+        'method' is 'direct' to evaluate the charges at every node or 'fft'
+        to use a ParticleMesh solver.  Grids are stored in the GridCache
+        'cache', which is GRIDCACHE if True and disabled if False."""
+        cache = GRIDCACHE if cache is True else cache
+        domain = get_domain(self.domain)
+        self.packed()
+        key = fingerprint(type(self).__name__, self.key, domain, resolution,
+                          method)
+        grid = cache.get(key) if cache else None
+        if grid is not None:
+            return grid
+        x, y = viewgrid(resolution, domain)
+        if method == 'fft':
+            z = self.solve(ParticleMesh(x[0], y[:, 0]))
+        elif method == 'direct':
+            z = self.magnitude(numpy.stack([x, y], axis=-1).reshape(-1, 2))
+        else:
+            raise ValueError('Unknown method: %s' % method)
+        grid = x, y, z.reshape(x.shape)
+        return cache.put(key, grid) if cache else grid
 
 
-class ElectricField:
+class ElectricField(ChargeField):
     """The electric field owing to a collection of charges."""
 
-    dt0 = 0.01  # The time step for integrations
+    dt0 = 0.008  # The time step for integrations
+    dtmin, dtmax = 1.e-4, 1.  # Bounds on adaptive time steps
+    maxsteps = 100000  # The step budget for each direction of a line
+    rtol, atol = 1.e-6, 1.e-6  # Error tolerances for the steps of lines()
+
+    # The spacing, refine, near and maxnodes settings of the FieldMap used
+    # for mode='map' (see FieldMap)
+    mapsettings = None, 8, 8, 10**6
+
+    def refresh(self):
+        """Repacks the charges after they have been modified.  The charge
+        index and field map are rebuilt when they are next needed."""
+        ChargeField.refresh(self)
+        self._index = None
+        self._fieldmap = None
+
+    def update(self, charge):
+        """Repacks one of the charges after it has been modified, without
+        repacking the others.  The charge index and field map are rebuilt
+        when they are next needed."""
+        i = next((k for k, c in enumerate(self.charges) if c is charge), None)
+        if i is None:
+            raise ValueError('Charge is not in the field')
+        if self._state[i][0] != id(charge) or \
+          not self.chargeset.update(charge):
+            self.refresh()
+            return
+        self._index, self._fieldmap = None, None
+        self._state[i] = charge_state(charge)
+        self._digests[i] = fingerprint(charge)
+        self.key = fingerprint(''.join(self._digests), self.theta)
 
-    def __init__(self, charges):
-        """Initializes the field given 'charges'."""
-        self.charges = charges
+    def get_index(self):
+        """Returns the ChargeIndex used to end field lines at the charges.
+        It is built on first use after the charges are packed."""
+        if self._index is None:
+            self._index = ChargeIndex(self.charges)
+        return self._index
+
+    index = property(get_index)
 
     def vector(self, x):
         """Returns the field vector."""
-        return numpy.sum([charge.E(x) for charge in self.charges], axis=0)
+        return self.chargeset.E(x)
 
     def magnitude(self, x):
         """Returns the magnitude of the field vector."""
@@ -293,104 +1823,635 @@ class ElectricField:
         from x-axis."""
         return self.magnitude(x) * cos(a - self.angle(x))
 
-    def line(self, x0):
+    def distance(self, x):
+        """Returns the distance from the point(s) x to the nearest charge."""
+        return self.chargeset.distance(x)
+
+    def step(self, x, tol, curvature=0):
+        """Returns the adaptive time step at the point(s) x.  The step is 'tol'
+        times the smaller of the distance to the nearest charge and the
+        radius of curvature (1/'curvature') of the line, bounded by dtmin and
+        dtmax."""
+        d = self.distance(x)
+        return numpy.clip(tol*d/numpy.maximum(1, d*curvature),
+                          self.dtmin, self.dtmax)
+
+    def fieldmap(self):
+        """Returns a FieldMap for the area of interest.  The map is built on
+        first use and cached until the charges are repacked or the domain
+        changes."""
+        domain = get_domain(self.domain)
+        if self._fieldmap is None or self._fieldmap.domain != domain or \
+          self._fieldmap.settings != tuple(self.mapsettings):
+            self._fieldmap = FieldMap(self, *self.mapsettings)
+        return self._fieldmap
+
+    # pylint: disable=too-many-arguments
+    def linekey(self, kind, x0, tol, mode):
+        """Returns the cache key for a field line of the given 'kind' ('line'
+        or 'lines') through x0."""
+        return fingerprint(kind, self.key, x0, tol, mode, self.dt0,
+                           self.dtmin, self.dtmax, self.maxsteps, self.rtol,
+                           self.atol, get_domain(self.domain)[:4],
+                           self.mapsettings if mode == 'map' else None)
+
+    def line(self, x0, tol=None, mode='exact', cache=None):
         """Returns the field line passing through x0.
+
+        The line is sampled at fixed time steps dt0 unless a tolerance 'tol'
+        is given, in which case the steps are scaled by the distance to the
+        nearest charge and the curvature of the line (see step()).  Values
+        of tol around 0.05 give smooth lines with far fewer points.
+
+        If 'mode' is 'map' then the line is traced through the interpolated
+        field of fieldmap(), which is much faster but approximate (see
+        FieldMap).  The default 'exact' mode evaluates the field of all of
+        the charges at every step.
+
+        If a 'cache' (e.g., a DiskCache) is given then the line is looked up
+        there before it is traced, and stored there afterwards.
+
         Refs: http://folk.uib.no/fcihh/seminar/lec1.pdf and lect2.pdf
               http://numbercrunch.de/blog/2013/05/visualizing-streamlines/
         and especially: "Electric field lines don't work",
         http://scitation.aip.org/content/aapt/journal/ajp/64/6/10.1119/1.18237
         """
 
-        if None in [XMIN, XMAX, YMIN, YMAX]:
-            raise ValueError('Domain must be set using init().')
-
-        # Set up integrator for the field line
-        streamline = lambda t, y: list(self.direction(y))
+        domain = get_domain(self.domain)
+        self.packed()
+
+        if cache:
+            key = self.linekey('line', x0, tol, mode)
+            x = cache.get(key)
+            if x is None:
+                x = cache.put(key, (self.line(x0, tol, mode).x,))
+            return FieldLine(x[0])
+
+        # Set up integrator for the field line, counting field evaluations
+        direction = self.tracer(mode)
+        nfev = [0]
+        def streamline(t, y):  # pylint: disable=unused-argument
+            """Returns the direction of the field line at y."""
+            nfev[0] += 1
+            return list(direction(y))
         solver = ode(streamline).set_integrator('vode')
 
-        # Initialize the coordinate lists
-        x = [x0]
-
-        # Integrate in both the forward and backward directions
-        dt = 0.008
+        # Initialize the field line
+        fieldline = FieldLine([x0], [])
 
         # Solve in both the forward and reverse directions
         for sign in [1, -1]:
 
             # Set the starting coordinates and time
             solver.set_initial_value(x0, 0)
+            dt, curvature, chord = self.dt0, 0, zeros_like(x0, dtype=float)
+            stats = TraceStats(x0, sign)
+            nfev[0], start = 0, time.perf_counter()
 
             # Integrate field line over successive time steps
-            while solver.successful():
+            while True:
+
+                if not solver.successful():
+                    stats.reason = TraceStats.FAILURE
+                    break
+                if stats.steps == self.maxsteps:
+                    stats.reason = TraceStats.BUDGET
+                    break
 
                 # Find the next step
+                y = array(solver.y)
+                if tol is not None:
+                    dt = self.step(y, tol, curvature)
                 solver.integrate(solver.t + sign*dt)
+                stats.steps += 1
+
+                # Estimate the curvature from the turn between chords
+                if tol is not None:
+                    curvature = turning_angle(chord, solver.y-y)/dt
+                    chord = solver.y-y
 
                 # Save the coordinates
                 if sign > 0:
-                    x.append(solver.y)
+                    fieldline.append(solver.y)
                 else:
-                    x.insert(0, solver.y)
-
-                # Check if line connects to a charge
-                flag = False
-                for c in self.charges:
-                    if c.is_close(solver.y):
-                        flag = True
-                        break
+                    fieldline.prepend(solver.y)
 
                 # Terminate line at charge or if it leaves the area of interest
-                if flag or not (XMIN < solver.y[0] < XMAX) or \
-                  not YMIN < solver.y[1] < YMAX:
+                if self.terminated(solver.y, domain):
+                    charge = self.index.query(solver.y)
+                    stats.reason, stats.charge = \
+                      (TraceStats.CHARGE, int(charge)) if charge >= 0 else \
+                      (TraceStats.DOMAIN, None)
                     break
 
-        return FieldLine(x)
-
-    def plot(self, nmin=-3.5, nmax=1.5):
-        """Plots the field magnitude."""
-        x, y = meshgrid(
-            linspace(XMIN/ZOOM+XOFFSET, XMAX/ZOOM+XOFFSET, 200),
-            linspace(YMIN/ZOOM, YMAX/ZOOM, 200))
-        z = zeros_like(x)
-        for i in range(x.shape[0]):
-            for j in range(x.shape[1]):
-                # pylint: disable=unsupported-assignment-operation
-                z[i, j] = log10(self.magnitude([x[i, j], y[i, j]]))
+            stats.nfev, stats.time = nfev[0], time.perf_counter() - start
+            fieldline.stats.append(stats)
+
+        fieldline.trim()
+        return fieldline
+
+    def is_close(self, x):
+        """Returns a boolean mask that is True where the point(s) x are close
+        to any of the charges."""
+        return self.index.is_close(x)
+
+    def terminated(self, x, domain=None):
+        """Returns a boolean mask that is True where field lines through the
+        point(s) x should end, i.e., close to a charge or outside of the
+        'domain' (which defaults to the field's)."""
+        domain = get_domain(self.domain if domain is None else domain)
+        return self.index.is_close(x) | ~domain.contains(x)
+
+    def tracer(self, mode):
+        """Returns the direction function for the tracing 'mode'."""
+        chargeset = self.chargeset
+        if mode == 'exact':
+            def direction(x):
+                """Returns a unit vector in the direction of the field."""
+                v = chargeset.E(x)
+                return (v.T/norm(v)).T
+            return direction
+        if mode == 'map':
+            return self.fieldmap().direction
+        raise ValueError('Unknown mode: %s' % mode)
+
+    # pylint: disable=too-many-locals
+    # pylint: disable=too-many-arguments
+    def lines(self, seeds, tol=None, workers=None, mode='exact', cache=None):
+        """Returns the field lines passing through each of the 'seeds'.
+
+        The lines are integrated together using a vectorized Dormand-Prince
+        5(4) scheme.  Each line takes the largest steps that keep its error
+        estimate within rtol and atol, and its points are interpolated at
+        the same output steps as line() using the continuous extension of
+        the scheme, so far fewer field evaluations are needed than there are
+        points.  Each stage costs one batched field evaluation for every
+        active line, and lines are masked out as they terminate at a charge
+        or leave the area of interest.  The 'mode' is as for line().
+
+        If 'workers' is greater than one then the lines are traced one at a
+        time in a pool of that many processes, which take small chunks of
+        seeds as they become free so that long lines do not hold up the
+        others.  The field is sent to each process once.  Lines are returned
+        in seed order.
+
+        If a 'cache' is given then only the lines that are not found there
+        are traced, and they are stored there afterwards."""
+
+        domain = get_domain(self.domain)
+        self.packed()
+        seeds = array(seeds, dtype=float).reshape(-1, 2)
+        n = len(seeds)
+
+        if cache:
+            keys = [self.linekey('lines', seed, tol, mode) for seed in seeds]
+            xs = [cache.get(key) for key in keys]
+            missing = [i for i, x in enumerate(xs) if x is None]
+            if missing:
+                traced = self.lines(seeds[missing], tol, workers, mode)
+                for i, fieldline in zip(missing, traced):
+                    xs[i] = cache.put(keys[i], (fieldline.x,))
+            return [FieldLine(x[0]) for x in xs]
+        direction = self.tracer(mode)  # Builds any field map before sharing
+
+        if workers is not None and workers > 1 and n > 1:
+            # Hand out chunks small enough that the workers finish together
+            workers = min(workers, n)
+            with ProcessPoolExecutor(workers, initializer=_init_worker,
+                                     initargs=(self, domain)) as pool:
+                return list(pool.map(_trace_worker, seeds, [tol]*n, [mode]*n,
+                                     chunksize=max(1, n//(8*workers))))
+
+        # Forward directions come first, then backward directions
+        y = numpy.concatenate([seeds, seeds])
+        sign = numpy.repeat([1., -1.], n)[:, newaxis]
+        f = sign*direction(y)  # The first stage of each direction's step
+        t, h = numpy.zeros(2*n), numpy.full(2*n, self.dt0)
+
+        # The time of the next output point of each direction, and the last
+        # point, chord and curvature for adaptive steps
+        tout = numpy.full(2*n, self.dt0) if tol is None else \
+          self.step(y, tol)
+        last, chord = y.copy(), numpy.zeros_like(y)
+        curvature = numpy.zeros(2*n)
+
+        # Visited coordinates and the index of the direction they belong to
+        xs, ks = [], []
+
+        # Tracing statistics for each direction.  The wall time of each
+        # batched step is shared among the lines that took it.
+        steps, nfev = numpy.zeros(2*n, dtype=int), numpy.ones(2*n, dtype=int)
+        elapsed = numpy.zeros(2*n)
+        reasons, charges = [TraceStats.BUDGET]*(2*n), [None]*(2*n)
+
+        # Lines stop where the field fails (e.g., at a zero-field point)
+        alive = numpy.isfinite(f).all(axis=-1)
+        for k in numpy.flatnonzero(~alive):
+            reasons[k] = TraceStats.FAILURE
+
+        def output(rows, points, rank):
+            """Saves the 'points' of the directions 'rows', where 'rank'
+            orders the points of each direction in time, up to the first
+            point that ends each line or exhausts its step budget."""
+            done = self.terminated(points, domain)
+            cut = numpy.full(2*n, self.maxsteps)
+            numpy.minimum.at(cut, rows[done], rank[done])
+            keep = (rank <= cut[rows]) & (steps[rows] + rank < self.maxsteps)
+            ended = keep & done & (rank == cut[rows])
+            for k, charge in zip(rows[ended],
+                                 self.index.query(points[ended])):
+                reasons[k], charges[k] = \
+                  (TraceStats.CHARGE, int(charge)) if charge >= 0 else \
+                  (TraceStats.DOMAIN, None)
+                alive[k] = False
+            xs.append(points[keep])
+            ks.append(rows[keep])
+            steps[:] += numpy.bincount(rows[keep], minlength=2*n)
+            alive[steps == self.maxsteps] = False
+
+        def dense(accepted, j, times):
+            """Returns the points of the 'accepted' steps 'j' at 'times'
+            using the continuous extension of the steps."""
+            t0, y0, dt, p = accepted
+            x = (times - t0[j])/dt[j, 0]
+            x = numpy.cumprod(numpy.repeat(x[:, newaxis], 4, 1), axis=1)
+            return y0[j] + dt[j]*numpy.einsum('mdj,mj->md', p[j], x)
+
+        while alive.any():
+
+            start, active = time.perf_counter(), numpy.flatnonzero(alive)
+
+            # Take a Dormand-Prince step for all of the active lines
+            y0, s, dt = y[active], sign[active], h[active][:, newaxis]
+            stages = numpy.empty((7,) + y0.shape)
+            stages[0] = f[active]
+            for i in range(1, 6):
+                stages[i] = s*direction(
+                    y0 + dt*numpy.tensordot(_DOPRI_A[i], stages[:i], 1))
+            y1 = y0 + dt*numpy.tensordot(_DOPRI_B, stages[:6], 1)
+            stages[6] = s*direction(y1)
+            nfev[active] += 6
+
+            # Estimate the error and adapt the step sizes
+            err = dt*numpy.tensordot(_DOPRI_E, stages, 1) / \
+              (self.atol + self.rtol*numpy.maximum(fabs(y0), fabs(y1)))
+            err = sqrt((err**2).mean(axis=-1))
+            failed = ~numpy.isfinite(err)
+            for k in active[failed]:
+                reasons[k] = TraceStats.FAILURE
+            alive[active[failed]] = False
+            with numpy.errstate(divide='ignore'):
+                h[active] = dt[:, 0]*numpy.clip(0.9*err**-0.2, 0.2, 10)
+
+            # Advance the lines with accepted steps
+            ok = err <= 1
+            rows = active[ok]
+            accepted = (t[rows], y0[ok], dt[ok],
+                        numpy.einsum('kmd,kj->mdj', stages[:, ok], _DOPRI_P))
+            t[rows] += dt[ok, 0]
+            y[rows], f[rows] = y1[ok], stages[6, ok]
+
+            # Output points at the fixed or adaptive steps within each step
+            if tol is None:
+                count = numpy.maximum(
+                    (t[rows]/self.dt0).astype(int) - steps[rows], 0)
+                j = numpy.repeat(numpy.arange(len(rows)), count)
+                rank = numpy.arange(len(j)) - \
+                  numpy.repeat(cumsum(count) - count, count)
+                output(rows[j],
+                       dense(accepted, j, (steps[rows[j]]+rank+1)*self.dt0),
+                       rank)
+            else:
+                j = numpy.flatnonzero(tout[rows] <= t[rows])
+                while j.size:
+                    k = rows[j]
+                    x = dense(accepted, j, tout[k])
+                    c = x - last[k]
+                    curvature[k] = turning_angle(chord[k], c)/norm(c)
+                    last[k], chord[k] = x, c
+                    output(k, x, numpy.zeros(len(k), dtype=int))
+                    tout[k] += self.step(x, tol, curvature[k])
+                    j = j[alive[k] & (tout[k] <= t[k])]
+
+            elapsed[active] += (time.perf_counter() - start)/len(active)
+
+        # Sort the visited coordinates by direction, preserving step order
+        owners = numpy.concatenate(ks) if ks else numpy.zeros(0, dtype=int)
+        visited = numpy.concatenate(xs) if xs else numpy.zeros((0, 2))
+        order = numpy.argsort(owners, kind='stable')
+        paths = numpy.split(visited[order],
+                            cumsum(numpy.bincount(owners, minlength=2*n))[:-1])
+
+        stats = [TraceStats(seeds[k % n], 1 if k < n else -1, steps[k],
+                            nfev[k], elapsed[k], reasons[k], charges[k])
+                 for k in range(2*n)]
+        return [FieldLine(numpy.concatenate([paths[n+i][::-1], seeds[i:i+1],
+                                             paths[i]]), stats[i::n])
+                for i in range(n)]
+
+    def solve(self, mesh):
+        """Returns the field magnitude on the nodes of the ParticleMesh
+        'mesh'."""
+        return norm(mesh.solve(self.chargeset))
+
+    # pylint: disable=too-many-arguments
+    def plot(self, nmin=-3.5, nmax=1.5, resolution=200, method='direct',
+             grid=None, ax=None):
+        """Plots the field magnitude on the axes 'ax' (the current pyplot
+        axes by default) and returns the contour set.  The magnitude is
+        taken from the FieldGrid 'grid' if one is given.  If the 'method'
+        is 'adaptive' then the magnitude is sampled with adaptive_sample(),
+        which refines the grid of the given 'resolution' only where it is
+        needed."""
+        ax = pyplot.gca() if ax is None else ax
         levels = arange(nmin, nmax+0.2, 0.2)
-        cmap = pyplot.cm.get_cmap('plasma')
-        pyplot.contourf(x, y, numpy.clip(z, nmin, nmax),
-                        10, cmap=cmap, levels=levels, extend='both')
+        cmap = matplotlib.colormaps['plasma']
+        if method == 'adaptive' and grid is None:
+            self.packed()
+            func = lambda x: numpy.clip(log10(self.magnitude(x)), nmin, nmax)
+            x, y, z = adaptive_sample(func, levels, resolution,
+                                      domain=self.domain)
+            ok = numpy.isfinite(z)
+            return ax.tricontourf(x[ok], y[ok], z[ok], cmap=cmap,
+                                  levels=levels, extend='both')
+        if grid is None:
+            x, y, z = self.sample_grid(resolution, method)
+        else:
+            x, y, z = grid.x, grid.y, norm(grid.E)
+        z = log10(z)
+        return ax.contourf(x, y, numpy.clip(z, nmin, nmax),
+                           10, cmap=cmap, levels=levels, extend='both')
+
+
+class FieldMap:
+    """An interpolated map of the electric field for fast approximate
+    tracing.
+
+    The field is sampled once on a coarse uniform grid over the area of
+    interest, and again on a grid that is 'refine' times finer over the
+    region around the charges.  Points are evaluated by bilinear
+    interpolation on the finest grid available.  Cells that come within
+    'near' grid spacings of a charge are not interpolated; the exact field
+    is evaluated there instead.
+
+    Error bound: for an isolated charge at distance d, bilinear
+    interpolation on a grid with spacing h has a relative field error (and
+    direction error, in radians) of at most about 1.5*(h/d)**2.  Since
+    interpolation is only used where d > near*h, the direction error per
+    step is below 1.5/near**2, or about 2.5% for the default near=8.  Along
+    a line these errors partly cancel, and traced lines typically stay
+    within a few percent of the distance travelled from their exact
+    counterparts.  Errors are larger close to zero-field points, where the
+    field direction is ill-defined anyway."""
+
+    def __init__(self, field, spacing=None, refine=8, near=8,
+                 maxnodes=10**6):
+        """Builds the map for 'field'.  The coarse grid 'spacing' defaults to
+        1/400th of the domain width.  The fine grid is coarsened as needed
+        to hold at most 'maxnodes' nodes."""
+
+        self.field = field
+        self.domain = domain = get_domain(field.domain)
+        self.settings = spacing, refine, near, maxnodes
+        self.near = near
+        h = spacing if spacing else (domain.xmax-domain.xmin)/400
+        self.levels = [self.sample([domain.xmin, domain.ymin],
+                                   [domain.xmax, domain.ymax], h)]
+
+        # Refine over the charges
+        x = numpy.concatenate([field.chargeset.sites] +
+                              [[c.x1, c.x2] for c in field.charges
+                               if isinstance(c, LineCharge)]).reshape(-1, 2)
+        if len(x) and refine > 1:
+            lo, hi = x.min(axis=0) - 2*near*h, x.max(axis=0) + 2*near*h
+            hf = max(h/refine, sqrt(numpy.prod(hi-lo)/maxnodes))
+            if hf < h:
+                self.levels.insert(0, self.sample(lo, hi, hf))
+
+        # Merge the levels into flat arrays of nodes and usable flags so
+        # that all of them are searched in one lookup
+        self.origins = array([level[0] for level in self.levels])
+        self.spacings = array([level[1] for level in self.levels])
+        self.shapes = array([level[3].shape[::-1] for level in self.levels])
+        self.usable = numpy.concatenate([level[3].ravel()
+                                         for level in self.levels])
+        self.nodes = numpy.concatenate([level[2].reshape(-1, 2)
+                                        for level in self.levels])
+        self.cell0 = insert(cumsum(numpy.prod(self.shapes, axis=1)), 0, 0)
+        self.node0 = insert(cumsum(numpy.prod(self.shapes+1, axis=1)), 0, 0)
+
+    def sample(self, lo, hi, h):
+        """Returns the (origin, spacing, field, usable) grid level spanning
+        lo to hi with spacing h.  The field is sampled with a ParticleMesh.
+        The usable flags mark the cells that are far enough from the charges
+        to be interpolated."""
+        lo = array(lo, dtype=float)
+        n = numpy.ceil((hi-lo)/h).astype(int) + 1
+        mesh = ParticleMesh(lo[0] + arange(n[0])*h, lo[1] + arange(n[1])*h)
+        e = mesh.solve(self.field.chargeset)
+
+        # Flag the nodes within reach of point charges using a window of
+        # nodes around each one
+        close = numpy.zeros((n[1], n[0]), dtype=bool)
+        sites = self.field.chargeset.sites
+        w = arange(-int(self.near)-1, int(self.near)+2)
+        ij = numpy.floor((sites-lo)/h).astype(int)[:, newaxis, :] + \
+          numpy.stack(meshgrid(w, w), axis=-1).reshape(-1, 2)
+        ok = (norm(lo + ij*h - sites[:, newaxis, :]) <= self.near*h) & \
+          ((ij >= 0) & (ij < n)).all(axis=-1)
+        close[ij[ok][:, 1], ij[ok][:, 0]] = True
+
+        # Flag the nodes near other charges directly
+        nodes = numpy.stack(meshgrid(mesh.x, mesh.y), axis=-1)
+        chargeset = self.field.chargeset
+        for charge in chargeset.segments + chargeset.others:
+            close |= charge.distance(nodes.reshape(-1, 2)).reshape(n[::-1]) \
+              <= self.near*h
+
+        usable = ~(close[:-1, :-1] | close[1:, :-1] | close[:-1, 1:] |
+                   close[1:, 1:])
+        return lo, h, e, usable
 
+    def vector(self, x):
+        """Returns the (approximate) field vector at the point(s) x."""
+        x = array(x, dtype=float)
+        if x.shape == (2,):
+            return self.point_vector(x)
+        points = x.reshape(-1, 2)
+
+        # Find the finest level with a usable cell under each point
+        f = (points[:, newaxis, :] - self.origins)/self.spacings[:, newaxis]
+        ij = numpy.floor(f).astype(int)
+        ok = ((ij >= 0) & (ij < self.shapes)).all(axis=-1)
+        cell = self.cell0[:-1] + ij[..., 1]*self.shapes[:, 0] + ij[..., 0]
+        ok &= self.usable[where(ok, cell, 0)]
+        level = numpy.argmax(ok, axis=1)
+        rows = numpy.flatnonzero(ok[arange(len(points)), level])
+        level = level[rows]
+
+        # Interpolate bilinearly from the four nodes about each point
+        f, ij = f[rows, level], ij[rows, level]
+        t = f - ij
+        w = numpy.stack([1-t, t], axis=1)  # Weights along each axis
+        w = (w[:, :, newaxis, 1]*w[:, newaxis, :, 0]).reshape(-1, 4)
+        nx = (self.shapes[level, 0] + 1)[:, newaxis]
+        node = (self.node0[level] + ij[:, 1]*nx[:, 0] + ij[:, 0])[:, newaxis] \
+          + [0, 1, 0, 1] + nx*[[0, 0, 1, 1]]
+        e = numpy.empty_like(points)
+        e[rows] = numpy.einsum('mk,mkd->md', w, self.nodes[node])
+
+        # Evaluate the remaining points exactly
+        todo = numpy.ones(len(points), dtype=bool)
+        todo[rows] = False
+        if todo.any():
+            e[todo] = self.field.chargeset.E(points[todo])
+
+        return e.reshape(x.shape)
+
+    def point_vector(self, x):
+        """Returns the (approximate) field vector at the single point x.  This
+        is vector() for the tracers' one point per call, without the
+        overhead of array operations."""
+        px, py = float(x[0]), float(x[1])
+        for (ox, oy), h, grid, usable in self.levels:
+            fx, fy = (px-ox)/h, (py-oy)/h
+            i, j = int(numpy.floor(fx)), int(numpy.floor(fy))
+            if 0 <= i < usable.shape[1] and 0 <= j < usable.shape[0] and \
+              usable[j, i]:
+                tx, ty = fx-i, fy-j
+                w = ((1-tx)*(1-ty), tx*(1-ty), (1-tx)*ty, tx*ty)
+                return array([
+                    w[0]*grid.item(j, i, k) + w[1]*grid.item(j, i+1, k) +
+                    w[2]*grid.item(j+1, i, k) + w[3]*grid.item(j+1, i+1, k)
+                    for k in (0, 1)])
+        return self.field.chargeset.E(x)
 
-class Potential:
-    """The potential owing to a collection of charges."""
+    def direction(self, x):
+        """Returns a unit vector pointing in the direction of the field."""
+        v = self.vector(x)
+        return (v.T/norm(v)).T
 
-    def __init__(self, charges):
-        """Initializes the field given 'charges'."""
-        self.charges = charges
+
+class FieldGrid:
+    """The electric field and potential of a field's charges, sampled over
+    the plotting view, that can be updated incrementally.
+
+    Fields and potentials superpose linearly, so when a single charge is
+    moved or changed the grids are updated by subtracting the charge's old
+    contribution and adding its new one.  An edit then costs one charge
+    evaluation per node instead of one for every charge.  Rounding errors
+    accumulate slowly over many edits; call recompute() to resample the
+    grids from scratch."""
+
+    def __init__(self, field, resolution=200):
+        """Samples the ElectricField 'field' at the given 'resolution'."""
+        self.field = field
+        self.x, self.y = viewgrid(resolution, field.domain)
+        self.points = numpy.stack([self.x, self.y], axis=-1).reshape(-1, 2)
+        self.E, self.V = None, None  # pylint: disable=invalid-name
+        self.recompute()
+
+    def recompute(self):
+        """Samples the field (E) and potential (V) at every node.  V is None
+        if the potential is not implemented for the charges."""
+        shape = self.x.shape
+        chargeset = self.field.packed()
+        self.E = chargeset.E(self.points).reshape(shape + (2,))
+        try:
+            self.V = chargeset.V(self.points).reshape(shape)
+        except RuntimeError:
+            self.V = None
+
+    def update(self, charge, **attrs):
+        """Sets the attributes 'attrs' (e.g., q or x) of one of the field's
+        charges and updates the grids.  Only that charge is repacked in the
+        field (see ElectricField.update()); other objects that share the
+        charges repack them when they next find them modified."""
+        if not any(c is charge for c in self.field.charges):
+            raise ValueError('Charge is not in the field')
+        e, v = self.E.reshape(-1, 2), None
+        if self.V is not None:
+            v = self.V.reshape(-1)
+
+        # Find the old and new contributions, restoring the charge if any of
+        # the attributes cannot be set, before changing the grids
+        old = [(name, getattr(charge, name)) for name in attrs]
+        de = -charge.E(self.points)
+        dv = None if v is None else -charge.V(self.points)
+        try:
+            for name, value in attrs.items():
+                if isinstance(value, (list, tuple)):
+                    value = array(value)
+                setattr(charge, name, value)
+            de += charge.E(self.points)
+            if v is not None:
+                dv += charge.V(self.points)
+        except BaseException:
+            for name, value in old:
+                try:
+                    setattr(charge, name, value)
+                except AttributeError:  # It was never set
+                    pass
+            raise
+        e += de
+        if v is not None:
+            v += dv
+        self.field.update(charge)
+
+        # Resample the nodes that coincided with the charge's old position
+        bad = ~numpy.isfinite(e).all(axis=-1)
+        if v is not None:
+            bad |= ~numpy.isfinite(v)
+        if bad.any():
+            e[bad] = self.field.chargeset.E(self.points[bad])
+            if v is not None:
+                v[bad] = self.field.chargeset.V(self.points[bad])
+
+
+class Potential(ChargeField):
+    """The potential owing to a collection of charges."""
 
     def magnitude(self, x):
         """Returns the magnitude of the potential."""
-        return sum(charge.V(x) for charge in self.charges)
+        return self.chargeset.V(x)
 
-    def plot(self, zmin=-1.5, zmax=1.5, step=0.25, linewidth=1, linestyle=':'):
-        """Plots the field magnitude."""
+    def solve(self, mesh):
+        """Returns the potential on the nodes of the ParticleMesh 'mesh'."""
+        return mesh.solve(self.chargeset, potential=True)
+
+    # pylint: disable=too-many-arguments
+    def plot(self, zmin=-1.5, zmax=1.5, step=0.25, linewidth=1, linestyle=':',
+             resolution=200, method='direct', grid=None, ax=None):
+        """Plots the field magnitude on the axes 'ax' (the current pyplot
+        axes by default) and returns the contour set.  The potential is
+        taken from the FieldGrid 'grid' if one is given.  If the 'method'
+        is 'adaptive' then the potential is sampled with adaptive_sample()."""
 
         if linewidth is None:
             linewidth = matplotlib.rcParams['lines.linewidth']
-
-        x, y = meshgrid(
-            linspace(XMIN/ZOOM+XOFFSET, XMAX/ZOOM+XOFFSET, 200),
-            linspace(YMIN/ZOOM, YMAX/ZOOM, 200))
-        z = zeros_like(x)
-        for i in range(x.shape[0]):
-            for j in range(x.shape[1]):
-                # pylint: disable=unsupported-assignment-operation
-                z[i, j] = self.magnitude([x[i, j], y[i, j]])
+        ax = pyplot.gca() if ax is None else ax
+
+        levels = numpy.arange(zmin, zmax+step, step)
+        if method == 'adaptive' and grid is None:
+            self.packed()
+            func = lambda x: numpy.clip(self.magnitude(x), zmin-step,
+                                        zmax+step)
+            x, y, z = adaptive_sample(func, levels, resolution,
+                                      domain=self.domain)
+            ok = numpy.isfinite(z)
+            return ax.tricontour(x[ok], y[ok], z[ok], levels,
+                                 linewidths=linewidth, linestyles=linestyle,
+                                 colors='k')
+        if grid is None:
+            x, y, z = self.sample_grid(resolution, method)
+        elif grid.V is None:
+            raise RuntimeError('Not implemented')
+        else:
+            x, y, z = grid.x, grid.y, grid.V
         # levels = arange(nmin, nmax+0.2, 0.2)
         # cmap = pyplot.cm.get_cmap('plasma')
-        pyplot.contour(x, y, z, numpy.arange(zmin, zmax+step, step),
-                       linewidths=linewidth, linestyles=linestyle, colors='k')
+        return ax.contour(x, y, z, levels, linewidths=linewidth,
+                          linestyles=linestyle, colors='k')
 
 
 # pylint: disable=too-few-public-methods
@@ -414,32 +2475,91 @@ class GaussianCircle:
         are equispaced.
 
         This method requires that the flux be in xor out everywhere on the
-        circle (unless 'uniform' is True)."""
-
-        # Create a dense array of points around the circle
-        a = radians(linspace(0, 360, 1001)) + self.a0
-        assert len(a)%4 == 1
-        x = self.r*array([cos(a), sin(a)]).T + self.x
-
-        if uniform:
-            flux = ones_like(a)
-
+        circle (unless 'uniform' is True).  Use the fluxpoints() function to
+        find the points of many circles at once."""
+        return fluxpoints([self], field, n, uniform)[0]
+
+
+class Renderer:
+    """A reusable headless render context.
+
+    The renderer owns one Agg figure and canvas, so that frames and scenes
+    are drawn and saved without pyplot.  When a layer ('magnitude',
+    'potential', 'fieldlines' or 'charges') is redrawn, the field line
+    collections and the charges' artists are updated in place; the contour
+    sets of the other layers are replaced.  The figure, canvas and axes are
+    reused."""
+
+    ZORDERS = {'magnitude': 1, 'potential': 2, 'fieldlines': 3, 'charges': 10}
+
+    def __init__(self, figsize=(6, 4.5), dpi=100, domain=None):
+        """Initializes the figure of size 'figsize' (inches) and resolution
+        'dpi'.  The view is of the 'domain' (see get_domain())."""
+        self.figure = Figure(figsize=figsize, dpi=dpi)
+        FigureCanvasAgg(self.figure)
+        self.ax = self.figure.add_subplot(1, 1, 1)
+        self.domain = domain
+        self.layers = {}
+        self.kinds = []  # The types of the charges drawn in the charge layer
+
+    def replace(self, layer, artists):
+        """Replaces the artists of the 'layer'."""
+        self.clear(layer)
+        for artist in artists:
+            artist.set_zorder(self.ZORDERS[layer])
+        self.layers[layer] = artists
+
+    def clear(self, layer=None):
+        """Removes the artists of the 'layer', or of every layer."""
+        for name in list(self.layers) if layer is None else [layer]:
+            for artist in self.layers.pop(name, []):
+                artist.remove()
+
+    def magnitude(self, field, **kwargs):
+        """Draws the magnitude of the ElectricField 'field' (see
+        ElectricField.plot())."""
+        self.replace('magnitude', [field.plot(ax=self.ax, **kwargs)])
+
+    def potential(self, potential, **kwargs):
+        """Draws the equipotentials of 'potential' (see Potential.plot())."""
+        self.replace('potential', [potential.plot(ax=self.ax, **kwargs)])
+
+    def fieldlines(self, fieldlines, **kwargs):
+        """Draws the 'fieldlines' (see plot_fieldlines())."""
+        if 'fieldlines' in self.layers:
+            plot_fieldlines(fieldlines, artists=self.layers['fieldlines'],
+                            **kwargs)
         else:
-            # Get the flux through each point.  Ensure the fluxes are either
-            # all in or all out.
-            flux = field.projection(x, a)
-
-            if numpy.sum(flux) < 0:
-                flux *= -1
-            assert alltrue(flux > 0)
-
-        # Create an integrated flux curve
-        intflux = insert(cumsum((flux[:-1]+flux[1:])/2), 0, 0)
-        assert isclose(intflux[-1], numpy.sum(flux[:-1]))
-
-        # Divide the integrated flux curve into n+1 portions, and calculate
-        # the corresponding angles.
-        v = linspace(0, intflux[-1], n+1)
-        a = lininterp2(intflux, a, v)[:-1]
-
-        return self.r*array([cos(a), sin(a)]).T + self.x
+            self.replace('fieldlines', list(plot_fieldlines(
+                fieldlines, ax=self.ax, **kwargs)))
+
+    def charges(self, charges):
+        """Draws the 'charges'.  Their artists are updated in place if the
+        charges are of the same types as those drawn last."""
+        kinds = [type(charge) for charge in charges]
+        if 'charges' in self.layers and kinds == self.kinds:
+            for charge, artist in zip(charges, self.layers['charges']):
+                charge.plot(artist=artist)
+        else:
+            self.replace('charges', [charge.plot(ax=self.ax)
+                                     for charge in charges])
+            self.kinds = kinds
+
+    def pixel_size(self):
+        """Returns the size of a pixel in the units of the domain (see
+        FieldLine.simplify())."""
+        return pixel_size(self.figure.get_size_inches(), self.figure.dpi,
+                          self.domain)
+
+    def draw(self):
+        """Renders the figure and returns the RGBA pixel buffer."""
+        finalize_plot(self.domain, self.ax)
+        self.figure.canvas.draw()
+        return numpy.asarray(self.figure.canvas.buffer_rgba())
+
+    def savefig(self, fname, **kwargs):
+        """Writes the figure to 'fname'.  The format (e.g., PNG or SVG) is
+        taken from the file name extension unless it is given as a
+        keyword argument (see matplotlib.figure.Figure.savefig())."""
+        finalize_plot(self.domain, self.ax)
+        self.figure.savefig(fname, **kwargs)
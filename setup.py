@@ -38,6 +38,7 @@ setup(
     download_url='https://github.com/tomduck/pandoc-xnos/tarball/'+VERSION,
 
     install_requires=['numpy', 'scipy', 'matplotlib'],
+    extras_require={'numexpr': ['numexpr']},
 
     py_modules=['electrostatics'],
 
@@ -0,0 +1,391 @@
+#! /usr/bin/env python3
+
+# Copyright 2016, 2019 Thomas J. Duck.
+# All rights reserved.
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""bench.py - benchmarks for electrostatics.py
+
+Usage:
+
+  python3 test/bench.py [--quick] [--filter TEXT] [-o results.json]
+  python3 test/bench.py --compare old.json new.json
+
+Each benchmark is timed over several repeats, and the best and median
+times per call are written as JSON together with the platform and package
+versions.  Results from two commits can then be compared with --compare.
+Benchmarks of features that the module being benchmarked does not have
+are skipped, so older commits can be measured too.
+"""
+
+import argparse
+import inspect
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy
+from numpy import radians
+
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot  # pylint: disable=wrong-import-position
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# pylint: disable=wrong-import-position
+import electrostatics
+from electrostatics import PointCharge, PointChargeFlatland, LineCharge
+from electrostatics import ElectricField, Potential, GaussianCircle
+
+
+#-----------------------------------------------------------------------------
+# Scenes
+
+def _fluxpoints(field, charges, indices, n, a0=None):
+    """Returns the flux points of circles of radius 0.1 about the charges
+    with the given 'indices'.  'a0' maps indices to offset angles."""
+    a0 = a0 if a0 else {}
+    return [x for i in indices for x in
+            GaussianCircle(charges[i].x, 0.1, a0.get(i, 0)).fluxpoints(field,
+                                                                        n)]
+
+def _line_line_seeds(a):
+    """Returns the seeds used by the line-line example."""
+    seeds = [[-0.51, y] for y in numpy.linspace(-a, a, 7)[1:-1]]
+    seeds += [[-0.49, y] for y in numpy.linspace(-a, a, 7)[1:-1]]
+    return seeds + [[-0.5, -a-0.01], [-0.5, a+0.01], [10, 0]]
+
+# The scenes from the examples directory.  Each is given by its domain, a
+# function returning its charges, and a function returning the seeds of its
+# field lines given the field and charges.
+SCENES = {
+    'biased-dipole-flatland': (
+        (-40, 40, -30, 30, 6, 2),
+        lambda: [PointChargeFlatland(2, [0, 0]),
+                 PointChargeFlatland(-1, [2, 0]),
+                 PointChargeFlatland(0, [4, 0])],
+        lambda f, c: _fluxpoints(f, c, [0], 24) + [[3, 0], [5, 0]]),
+    'biased-dipole': (
+        (-40, 40, -30, 30, 6, 2),
+        lambda: [PointCharge(2, [0, 0]), PointCharge(-1, [2, 0]),
+                 PointCharge(0, [6.82842712474619, 0])],
+        lambda f, c: list(GaussianCircle(c[0].x, 29).fluxpoints(f, 12)) +
+        list(GaussianCircle(c[1].x, 0.1).fluxpoints(f, 12))),
+    'cup-point': (
+        (-200, 200, -150, 150, 30, 0),
+        lambda: [LineCharge(0.2, [-2, -0.5], [-2, 0.5]),
+                 LineCharge(0.4, [-2, -0.5], [0, -0.5]),
+                 LineCharge(0.4, [-2, 0.5], [0, 0.5]),
+                 PointCharge(-1, [1, 0])],
+        lambda f, c: _fluxpoints(f, c, [3], 15) + [[-3, 0]]),
+    'dipole-flatland': (
+        (-40, 40, -30, 30, 6, 0),
+        lambda: [PointChargeFlatland(1, [-1, 0]),
+                 PointChargeFlatland(-1, [1, 0])],
+        lambda f, c: _fluxpoints(f, c, [0], 12) + [[3, 0], [5, 0]]),
+    'dipole': (
+        (-40, 40, -30, 30, 6, 0),
+        lambda: [PointCharge(1, [-1, 0]), PointCharge(-1, [1, 0])],
+        lambda f, c: _fluxpoints(f, c, [0], 12) + [[10, 0]]),
+    'false-monopole': (
+        (-200, 200, -150, 150, 30, 0),
+        lambda: [PointCharge(1, [-2, 0]), PointCharge(1, [2, 0]),
+                 PointCharge(1, [0, -2]), PointCharge(1, [0, 2]),
+                 PointCharge(-4, [0, 0])],
+        lambda f, c: _fluxpoints(f, c, range(4), 12,
+                                 {2: radians(90), 3: radians(-90)})),
+    'line-line': (
+        (-200, 200, -150, 150, 35, 0),
+        lambda: [LineCharge(1, [-0.5, -3], [-0.5, 3]),
+                 LineCharge(-1, [0.5, -3], [0.5, 3])],
+        lambda f, c: _line_line_seeds(3)),
+    'line-point': (
+        (-80, 80, -60, 60, 15, 0),
+        lambda: [LineCharge(1, [-1, -2], [-1, 2]), PointCharge(-1, [1, 0])],
+        lambda f, c: _fluxpoints(f, c, [1], 12) + [[-10, 0]]),
+    'line': (
+        (-40, 40, -30, 30, 6, 0),
+        lambda: [LineCharge(1, [0, -2], [0, 2])],
+        lambda f, c: list(GaussianCircle([0, 0], 29).fluxpoints(f, 12))),
+    'linear-quadrupole-cluster': (
+        (-40, 40, -30, 30, 6, 0),
+        lambda: [PointCharge(2, [-2, 0]), PointCharge(-1, [-2/3, 0]),
+                 PointCharge(-1, [0, -2/3]), PointCharge(-1, [0, 2/3]),
+                 PointCharge(-1, [2/3, 0]), PointCharge(2, [2, 0]),
+                 PointCharge(0, [0, 0])],
+        lambda f, c: _fluxpoints(f, c, [0, 5], 12)),
+    'linear-quadrupole': (
+        (-40, 40, -30, 30, 6, 0),
+        lambda: [PointCharge(2, [-2, 0]), PointCharge(-4, [0, 0]),
+                 PointCharge(2, [2, 0])],
+        lambda f, c: _fluxpoints(f, c, [0, 2], 12)),
+    'quadrupole': (
+        (-200, 200, -150, 150, 33, 0),
+        lambda: [PointCharge(1, [-2, 0]), PointCharge(1, [2, 0]),
+                 PointCharge(-1, [0, -2]), PointCharge(-1, [0, 2]),
+                 PointCharge(0, [0, 0])],
+        lambda f, c: _fluxpoints(f, c, [2, 3], 12,
+                                 {2: radians(90), 3: radians(-90)}) +
+        [[-1, 0], [1, 0], [-3, 0], [3, 0]]),
+    'two-positive-charges': (
+        (-40, 40, -30, 30, 6, 0),
+        lambda: [PointCharge(1, [-2, 0]), PointCharge(1, [2, 0]),
+                 PointCharge(0, [0, 0])],
+        lambda f, c: _fluxpoints(f, c, [0, 1], 12, {0: radians(-180)})),
+}
+
+def scene(name, scale=1):
+    """Initializes the domain of the scene 'name', with its extent
+    multiplied by 'scale', and returns the charges and field."""
+    xmin, xmax, ymin, ymax, zoom, xoffset = SCENES[name][0]
+    electrostatics.init(xmin*scale, xmax*scale, ymin*scale, ymax*scale, zoom,
+                        xoffset)
+    charges = SCENES[name][1]()
+    return charges, ElectricField(charges)
+
+def cluster(n, kind=PointCharge):
+    """Returns n charges of alternating sign scattered over [-4, 4]**2."""
+    x = numpy.random.RandomState(0).uniform(-4, 4, (n, 2))
+    if kind is LineCharge:
+        return [LineCharge((-1)**i, p, p + [0, 0.5]) for i, p in enumerate(x)]
+    return [kind((-1)**i, p) for i, p in enumerate(x)]
+
+def points(n):
+    """Returns n evaluation points scattered over [-5, 5]**2."""
+    return numpy.random.RandomState(1).uniform(-5, 5, (n, 2))
+
+
+#-----------------------------------------------------------------------------
+# Timing
+
+def measure(func, repeat=5, mintime=0.05):
+    """Times calls to 'func'.  Each repeat makes enough calls to last at
+    least 'mintime' seconds.  Returns the best and median times per call,
+    and the calls per repeat."""
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    number = max(1, int(mintime/elapsed)) if elapsed > 0 else 1000
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        times.append((time.perf_counter() - start)/number)
+    return {'best': min(times), 'median': float(numpy.median(times)),
+            'number': number, 'repeat': repeat}
+
+
+#-----------------------------------------------------------------------------
+# Benchmarks
+
+def bench_kernels(quick):
+    """Times the field kernels, sweeping point and charge counts."""
+    sizes = [100, 10000] if quick else [100, 1000, 10000, 100000, 1000000]
+    for n in sizes:
+        x = points(n)
+        charge = PointCharge(1, [0.1, 0.2])
+        yield 'PointCharge.E', {'points': n}, lambda: charge.E(x)
+        charge = LineCharge(1, [-1, 0.1], [1, 0.1])
+        yield 'LineCharge.E', {'points': n}, lambda: charge.E(x)
+
+    counts = [1, 10, 100] if quick else [1, 10, 100, 1000]
+    for kind in [PointCharge, LineCharge]:
+        for m in counts:
+            for n in sizes[:-1] if m == counts[-1] else sizes:
+                field = ElectricField(cluster(m, kind))
+                x = points(n)
+                yield 'ElectricField.vector', \
+                  {'charges': m, 'kind': kind.__name__, 'points': n}, \
+                  lambda: field.vector(x)
+
+def bench_lines(quick):
+    """Times ElectricField.line() against ElectricField.lines() for each
+    scene, sweeping domain size."""
+    names = ['dipole', 'line-point'] if quick else list(SCENES)
+    for name in names:
+        for scale in [1] if quick else [1, 2, 4]:
+            charges, field = scene(name, scale)
+            seeds = SCENES[name][2](field, charges)
+            domain = (electrostatics.XMIN, electrostatics.XMAX,
+                      electrostatics.YMIN, electrostatics.YMAX,
+                      electrostatics.ZOOM, electrostatics.XOFFSET)
+            params = {'scene': name, 'scale': scale, 'lines': len(seeds)}
+            def func(field=field, seeds=seeds, domain=domain):
+                electrostatics.init(*domain)
+                for seed in seeds:
+                    field.line(seed)
+            yield 'ElectricField.line', params, func
+            if not hasattr(field, 'lines'):
+                continue
+            def batched(field=field, seeds=seeds, domain=domain):
+                electrostatics.init(*domain)
+                field.lines(seeds)
+            yield 'ElectricField.lines', params, batched
+
+def bench_plots(quick):
+    """Times the field and potential plots, sweeping resolution.  Versions
+    whose plot() has no 'resolution' argument are timed once, at their
+    fixed resolution."""
+    names = ['dipole'] if quick else ['dipole', 'cup-point', 'false-monopole']
+    cache = getattr(electrostatics, 'GRIDCACHE', None)
+    sweep = 'resolution' in inspect.signature(ElectricField.plot).parameters
+    for name in names:
+        for resolution in ([100, 200] if quick else [100, 200, 400]) \
+          if sweep else [None]:
+            charges, field = scene(name)
+            params = {'scene': name, 'resolution': resolution}
+            for obj in [field, Potential(charges)]:
+                def func(obj=obj, domain=SCENES[name][0], r=resolution):
+                    electrostatics.init(*domain)
+                    if cache is not None:
+                        cache.clear()  # Time the evaluation
+                    pyplot.clf()
+                    if r is None:
+                        obj.plot()
+                    else:
+                        obj.plot(resolution=r)
+                yield type(obj).__name__ + '.plot', params, func
+
+def bench_fluxpoints(quick):
+    """Times GaussianCircle.fluxpoints(), sweeping the number of points."""
+    names = ['dipole'] if quick else ['dipole', 'cup-point', 'line-point',
+                                      'false-monopole']
+    for name in names:
+        charges, field = scene(name)
+        charge = next(c for c in charges if isinstance(c, PointCharge))
+        g = GaussianCircle(charge.x, 0.1)
+        for n in [12] if quick else [12, 48, 192]:
+            yield 'GaussianCircle.fluxpoints', {'scene': name, 'n': n}, \
+              lambda g=g, field=field, n=n: g.fluxpoints(field, n)
+    if not hasattr(electrostatics, 'fluxpoints'):
+        return
+    for m in [10] if quick else [10, 50]:
+        charges = cluster(m)
+        field = ElectricField(charges)
+        circles = [GaussianCircle(c.x, 0.02) for c in charges]
+        yield 'fluxpoints', {'charges': m, 'n': 12}, \
+          lambda field=field, circles=circles: \
+          electrostatics.fluxpoints(circles, field, 12)
+
+def bench_fieldmap(quick):
+    """Times exact and interpolated (mode='map') tracing through a cluster
+    of charges."""
+    if not hasattr(ElectricField, 'fieldmap'):
+        return
+    domain = (-6, 6, -4.5, 4.5)
+    electrostatics.init(*domain)
+    charges = cluster(100 if quick else 300)
+    field = ElectricField(charges)
+    seeds = numpy.array([c.x for c in charges[:40:2]]) + [0.05, 0]
+    fieldmap = field.fieldmap()
+    for n in [1, 1000]:
+        x = numpy.random.RandomState(2).uniform(-4, 4, (n, 2)).squeeze()
+        yield 'FieldMap.vector', {'charges': len(charges), 'points': n}, \
+          lambda x=x: fieldmap.vector(x)
+    for mode in ['exact', 'map']:
+        params = {'charges': len(charges), 'mode': mode}
+        def func(mode=mode):
+            electrostatics.init(*domain)
+            for seed in seeds[:5]:
+                field.line(seed, mode=mode)
+        yield 'ElectricField.line', dict(params, lines=5), func
+        def batched(mode=mode):
+            electrostatics.init(*domain)
+            field.lines(seeds, mode=mode)
+        yield 'ElectricField.lines', dict(params, lines=len(seeds)), batched
+
+BENCHMARKS = [bench_kernels, bench_lines, bench_plots, bench_fluxpoints,
+              bench_fieldmap]
+
+
+#-----------------------------------------------------------------------------
+# Results
+
+def metadata():
+    """Returns a description of the platform and code being benchmarked."""
+    get_backend = getattr(electrostatics, 'get_backend', None)
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit': commit, 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'numpy': numpy.__version__, 'matplotlib': matplotlib.__version__,
+            'backend': get_backend().name if get_backend else 'numpy'}
+
+def run(quick=False, pattern=None, repeat=5):
+    """Runs the benchmarks and returns the results."""
+    results = []
+    for bench in BENCHMARKS:
+        for name, params, func in bench(quick):
+            if pattern and pattern not in name + json.dumps(params):
+                continue
+            result = measure(func, repeat)
+            results.append(dict(name=name, params=params, **result))
+            print('%-28s %-60s %10.3g s' % (name, json.dumps(params),
+                                            result['best']), file=sys.stderr)
+    return {'metadata': metadata(), 'results': results}
+
+def compare(old, new):
+    """Prints the ratios of the best times in the results 'new' to those in
+    'old' for the benchmarks that appear in both."""
+    key = lambda r: (r['name'], json.dumps(r['params'], sort_keys=True))
+    before = {key(r): r['best'] for r in old['results']}
+    print('%-28s %-60s %10s %10s %8s' % ('benchmark', 'params', 'old (s)',
+                                         'new (s)', 'ratio'))
+    for r in new['results']:
+        if key(r) in before:
+            print('%-28s %-60s %10.3g %10.3g %8.2f' %
+                  (r['name'], key(r)[1], before[key(r)], r['best'],
+                   r['best']/before[key(r)]))
+
+def main():
+    """Runs the benchmarks or compares results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--quick', action='store_true',
+                        help='run smaller sweeps')
+    parser.add_argument('--filter', help='only run benchmarks whose name or '
+                        'parameters contain this text')
+    parser.add_argument('--repeat', type=int, default=5,
+                        help='repeats per benchmark (default 5)')
+    parser.add_argument('-o', '--output', help='write JSON results here '
+                        '(default: stdout)')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two JSON result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f1, open(args.compare[1]) as f2:
+            compare(json.load(f1), json.load(f2))
+        return
+
+    results = run(args.quick, args.filter, args.repeat)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -18,13 +18,32 @@
 # along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import unittest
+import importlib.util
+import os
 import sys
+import tempfile
+import tracemalloc
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
+import numpy
 from numpy import array, sqrt, cos, fabs, radians, isclose, append
+from numpy import arange, linspace, meshgrid, newaxis, sin, arctan2
 
 from electrostatics import norm, point_line_distance, angle, is_left
+from electrostatics import point_segment_distance, turning_angle
+from electrostatics import segment_E, segment_V, write_grids
+from electrostatics import adaptive_sample, get_domain, Domain
 from electrostatics import PointCharge, PointChargeFlatland, LineCharge
-from electrostatics import ElectricField, GaussianCircle
+from electrostatics import ChargeSet, BarnesHut, ParticleMesh, ChargeIndex
+from electrostatics import FieldLine, FieldMap, FieldGrid, TraceStats
+from electrostatics import trace_report, arrowheads, plot_fieldlines
+from electrostatics import fluxpoints
+from electrostatics import GridCache, DiskCache, Renderer
+from electrostatics import ElectricField, Potential, GaussianCircle
+import electrostatics
+import matplotlib
+from matplotlib import pyplot
 
 # pylint: disable=invalid-name
 
@@ -58,6 +77,24 @@ class TestFunctions(unittest.TestCase):
         self.assertTrue(isclose(angle([[1, 1], [0, 1], [-1, 1]], x1, x2),
                                 [radians(45), radians(90), radians(135)]).all())
 
+    def test_point_segment_distance(self):
+        """Tests point_segment_distance()."""
+        x1, x2 = [0, 0], [2, 0]
+        self.assertEqual(point_segment_distance([1, 1], x1, x2), 1)
+        self.assertEqual(point_segment_distance([-3, 4], x1, x2), 5)
+        self.assertEqual(point_segment_distance([3, -1], x1, x2), sqrt(2))
+        self.assertTrue(
+            (point_segment_distance([[1, 1], [-3, 4], [3, -1]], x1, x2) ==
+             [1, 5, sqrt(2)]).all())
+
+    def test_turning_angle(self):
+        """Tests turning_angle()."""
+        self.assertEqual(turning_angle([1, 0], [1, 0]), 0)
+        self.assertTrue(isclose(turning_angle([1, 0], [1, -1]), radians(45)))
+        self.assertTrue(isclose(turning_angle([[1, 0], [0, 2]],
+                                              [[-1, 1], [1, 0]]),
+                                [radians(135), radians(90)]).all())
+
     def test_is_left(self):
         """Tests is_left()."""
 
@@ -76,6 +113,61 @@ class TestFunctions(unittest.TestCase):
                          [True, False, False]).all())
 
 
+    def test_adaptive_sample(self):
+        """Tests adaptive_sample()."""
+        electrostatics.init(-4, 4, -3, 3)
+        levels = [0.5, 1.5]
+        func = lambda x: norm(x)  # Circular contours of radius 0.5 and 1.5
+        x, y, z = adaptive_sample(func, levels, (81, 61), depth=3)
+        hx, hy = 8/80, 6/64  # The finest spacings; 60 rounds up to 8*8
+        self.assertTrue(isclose(z, norm(numpy.stack([x, y], axis=-1))).all())
+        self.assertEqual((x.min(), x.max(), y.min(), y.max()), (-4, 4, -3, 3))
+        self.assertLess(len(z), 81*61/4)
+
+        # The finest nodes follow the contours
+        i, j = numpy.rint((x + 4)/hx), numpy.rint((y + 3)/hy)
+        fine = (i % 2 == 1) | (j % 2 == 1)
+        self.assertTrue(fine.any())
+        self.assertTrue((numpy.min(fabs(z[fine, newaxis] - levels), axis=-1)
+                         < 4*hx).all())
+
+
+class TestDomain(unittest.TestCase):
+    """Tests the Domain class."""
+
+    def test_view(self):
+        """Tests the plotting view."""
+        self.assertEqual(Domain(-4, 4, -3, 3).view(), (-4, 4, -3, 3))
+        self.assertEqual(Domain(-4, 4, -3, 3, 2, 1).view(),
+                         (-1, 3, -1.5, 1.5))
+
+    def test_contains(self):
+        """Tests the inside test."""
+        domain = Domain(-4, 4, -3, 3)
+        x = [[0, 0], [4, 0], [0, -3.5], [3.9, 2.9]]
+        self.assertEqual(domain.contains(x).tolist(),
+                         [True, False, False, True])
+        self.assertTrue(domain.contains([0, 0]))
+
+    def test_pixel_size(self):
+        """Tests the pixel size."""
+        domain = Domain(-4, 4, -3, 3)
+        self.assertTrue(isclose(electrostatics.pixel_size((1, 1), 100,
+                                                          domain), 6/98))
+        self.assertTrue(isclose(Renderer((6, 4.5), 100, domain).pixel_size(),
+                                8/588))
+
+    def test_get_domain(self):
+        """Tests the default domain."""
+        electrostatics.init(-4, 4, -3, 3, 2)
+        self.assertEqual(get_domain(), Domain(-4, 4, -3, 3, 2, 0))
+        domain = Domain(0, 1, 0, 1)
+        self.assertIs(get_domain(domain), domain)
+        x, y = electrostatics.viewaxes(3, domain)
+        self.assertEqual(x.tolist(), [0, 0.5, 1])
+        self.assertEqual(y.tolist(), [0, 0.5, 1])
+
+
 class TestPointCharge(unittest.TestCase):
     """Tests the PointCharge class."""
 
@@ -175,6 +267,310 @@ class TestLineCharge(unittest.TestCase):
         self.assertTrue(isclose(E([0, 2]), [0, 2]).all())
         self.assertTrue(isclose(E([0, -2]), [0, -2]).all())
 
+    def test_is_close(self):
+        """Tests the proximity test for single points and batches."""
+        x = [[0, 0.005], [0.5, -0.02], [1.005, 0.005], [1.02, 0], [-1.009, 0]]
+        self.assertTrue(self.charge1a.is_close(x[0]))
+        self.assertFalse(self.charge1a.is_close(x[1]))
+        self.assertEqual(self.charge1a.is_close(x).tolist(),
+                         [True, False, True, False, True])
+        self.assertEqual(self.charge1b.is_close(x).tolist(),
+                         [True, False, True, False, True])
+
+
+class TestChargeSet(unittest.TestCase):
+    """Tests the ChargeSet class."""
+
+    def setUp(self):
+        """Creates a mixture of charges."""
+        self.charges = [PointCharge(2, [0, 0]), PointCharge(-1, [1, 1]),
+                        PointCharge(0, [3, 0]), LineCharge(1, [-2, 0], [-2, 2]),
+                        PointCharge(-0.5, [-1, 2])]
+        self.x = array([[0.5, 0.3], [2, -1], [-3, 1], [4, 4], [0.1, 2]])
+
+    def test_E(self):
+        """Tests the packed electric field against direct summation."""
+        chargeset = ChargeSet(self.charges)
+        chargeset.maxbytes = 64  # Forces one point per block
+        expected = sum(charge.E(self.x) for charge in self.charges)
+        self.assertTrue(isclose(chargeset.E(self.x), expected).all())
+        self.assertTrue(isclose(chargeset.E(self.x[1]), expected[1]).all())
+
+        charges = self.charges + [PointChargeFlatland(1, [0, -1])]
+        expected += charges[-1].E(self.x)
+        self.assertTrue(isclose(ChargeSet(charges).E(self.x), expected).all())
+
+    def test_maxbytes(self):
+        """Tests that the kernel temporaries respect the memory cap."""
+        state = numpy.random.RandomState(0)
+        charges = [PointCharge(q, x) for q, x in
+                   zip(state.uniform(-1, 1, 3000),
+                       state.uniform(-5, 5, (3000, 2)))] + \
+          [LineCharge(1, x1, x2) for x1, x2 in
+           zip(state.uniform(-5, 5, (100, 2)), state.uniform(-5, 5, (100, 2)))]
+        chargeset = ChargeSet(charges)
+        chargeset.maxbytes = 2**20
+        x = state.uniform(-5, 5, (2000, 2))
+        for func in chargeset.E, chargeset.V, chargeset.distance:
+            tracemalloc.start()
+            try:
+                func(x)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            # Allow for copies of the points and the results
+            self.assertLess(peak, chargeset.maxbytes + 4*x.nbytes)
+
+    def test_V(self):
+        """Tests the packed potential against direct summation."""
+        chargeset = ChargeSet(self.charges)
+        expected = sum(charge.V(self.x) for charge in self.charges)
+        self.assertTrue(isclose(chargeset.V(self.x), expected).all())
+        self.assertTrue(isclose(chargeset.V(self.x[2]), expected[2]))
+
+        chargeset = ChargeSet([PointChargeFlatland(1, [0, 0])])
+        self.assertRaises(RuntimeError, chargeset.V, self.x)
+
+    def test_segments(self):
+        """Tests the fused line segment kernels against quadrature."""
+        x1, x2 = array([[-2, 0], [1, 1], [0, -1]]), array([[-2, 2], [3, 0],
+                                                          [2, -1]])
+        lam = array([1, -0.5, 2])
+        x = array([[0.5, 0.3], [2, -1.5], [-3, 1], [4, 4], [0.1, 2]])
+        n = 2000  # Quadrature points per segment
+        s = ((arange(n) + 0.5)/n)[:, newaxis, newaxis]
+        points = (x1 + s*(x2 - x1)).reshape(-1, 2)
+        q = numpy.tile(lam*norm(x2 - x1)/n, n)
+        charges = [PointCharge(qi, xi) for qi, xi in zip(q, points)]
+        expected = ChargeSet(charges).E(x)
+        self.assertTrue(isclose(segment_E(x, x1, x2, lam), expected,
+                                rtol=1.e-4).all())
+        expected = ChargeSet(charges).V(x)
+        self.assertTrue(isclose(segment_V(x, x1, x2, lam), expected,
+                                rtol=1.e-4).all())
+
+        segments = [LineCharge(*args) for args in zip(lam, x1, x2)]
+        chargeset = ChargeSet(segments + self.charges[:3])
+        self.assertEqual(len(chargeset.lam), 3)
+        expected = [min(c.distance(p) for c in chargeset.charges) for p in x]
+        self.assertTrue(isclose(chargeset.distance(x), expected).all())
+
+
+class TestBackend(unittest.TestCase):
+    """Tests the array-compute backends."""
+
+    def setUp(self):
+        """Creates a mixture of charges and some evaluation points."""
+        self.charges = [PointCharge(2, [0, 0]), PointCharge(-1, [1, 1]),
+                        LineCharge(1, [-2, 0], [-2, 2])]
+        x = linspace(-3, 3, 101)
+        self.x = numpy.stack(meshgrid(x, x + 0.01), axis=-1).reshape(-1, 2)
+
+    def tearDown(self):
+        """Restores the default backend."""
+        electrostatics.set_backend('numpy')
+
+    def test_numpy(self):
+        """Tests the default backend."""
+        self.assertEqual(electrostatics.get_backend().name, 'numpy')
+        self.assertEqual(electrostatics.evaluate('a*b + 1', a=2, b=3), 7)
+        self.assertRaises(ValueError, electrostatics.set_backend, 'fortran')
+
+    @unittest.skipUnless(importlib.util.find_spec('numexpr'),
+                         'numexpr is not installed')
+    def test_numexpr(self):
+        """Tests that the numexpr backend agrees with numpy."""
+        chargeset = ChargeSet(self.charges)
+        expected = [chargeset.E(self.x), chargeset.V(self.x)] + \
+          [charge.E(self.x) for charge in self.charges]
+        electrostatics.set_backend('numexpr')
+        electrostatics.get_backend().minsize = 0
+        self.assertEqual(electrostatics.get_backend().name, 'numexpr')
+        results = [chargeset.E(self.x), chargeset.V(self.x)] + \
+          [charge.E(self.x) for charge in self.charges]
+        for result, value in zip(results, expected):
+            self.assertTrue(isclose(result, value).all())
+
+
+class TestBarnesHut(unittest.TestCase):
+    """Tests the BarnesHut class."""
+
+    def setUp(self):
+        """Creates a cluster of charges and some evaluation points."""
+        x = array([[i*0.37 % 1, i*0.61 % 1] for i in range(200)])
+        self.charges = [PointCharge(1 + i%3, p) for i, p in enumerate(x)]
+        self.charges += [PointChargeFlatland(-1, p+[0.5, 0]) for p in x[:50]]
+        self.charges += [LineCharge(1, [-1, -1], [-1, 1])]
+        self.x = array([[0.25, 3], [4, -2], [-3, 0.5], [0.55, 0.45]])
+
+    def test_E(self):
+        """Tests the approximate field against direct summation."""
+        expected = ChargeSet(self.charges).E(self.x)
+        barneshut = BarnesHut(self.charges, theta=0)
+        self.assertTrue(isclose(barneshut.E(self.x), expected).all())
+        for theta, tol in [(0.3, 0.03), (0.1, 0.003)]:
+            e = BarnesHut(self.charges, theta).E(self.x)
+            self.assertTrue((norm(e-expected) < tol*norm(expected)).all())
+
+    def test_bounds(self):
+        """Tests that the root node bounds the charges, wherever they are."""
+        charges = [PointCharge(c.q, c.x + [1000, -500])
+                   for c in self.charges[:200]]
+        tree = BarnesHut(charges).trees[0]
+        self.assertTrue(isclose(tree['center'][0], [1000.5, -499.5],
+                                atol=0.01).all())
+        self.assertLess(tree['width'][0], 1)
+        x = self.x + [1000, -500]
+        expected = ChargeSet(charges).E(x)
+        e = BarnesHut(charges, 0.1).E(x)
+        self.assertTrue((norm(e-expected) < 0.003*norm(expected)).all())
+        self.assertEqual(len(BarnesHut([]).trees[0]['q']), 0)
+        self.assertEqual(BarnesHut([]).E(self.x).shape, self.x.shape)
+
+    def test_V(self):
+        """Tests the approximate potential against direct summation."""
+        charges = self.charges[:200]
+        expected = ChargeSet(charges).V(self.x)
+        v = BarnesHut(charges, 0.3).V(self.x)
+        self.assertTrue((fabs(v-expected) < 0.03*fabs(expected)).all())
+        self.assertRaises(RuntimeError, BarnesHut(self.charges).V, self.x)
+
+    def test_field(self):
+        """Tests evaluation through ElectricField."""
+        field = ElectricField(self.charges, theta=0.3)
+        self.assertIsInstance(field.chargeset, BarnesHut)
+        expected = ElectricField(self.charges).vector(self.x[0])
+        self.assertTrue(norm(field.vector(self.x[0])-expected) <
+                        0.03*norm(expected))
+
+
+class TestParticleMesh(unittest.TestCase):
+    """Tests the ParticleMesh class."""
+
+    def setUp(self):
+        """Creates charges on and off a mesh."""
+        self.charges = [PointCharge(-2, [-1.03, 0.01]),
+                        PointCharge(2, [1.02, 0.23]), PointCharge(1, [7, 0]),
+                        LineCharge(1, [-2, -2.5], [2, -2.5])]
+        self.mesh = ParticleMesh(linspace(-4, 4, 41), linspace(-3, 3, 31))
+        self.x = numpy.stack(meshgrid(self.mesh.x, self.mesh.y), axis=-1)
+
+    def test_E(self):
+        """Tests the mesh field against direct summation."""
+        expected = ChargeSet(self.charges).E(self.x)
+        e = self.mesh.solve(ChargeSet(self.charges))
+        self.assertEqual(e.shape, expected.shape)
+        self.assertTrue((norm(e-expected) < 0.03*norm(expected)).all())
+
+        charges = [PointChargeFlatland(1, [0.11, 0.52]),
+                   PointChargeFlatland(-1, [0.93, -0.48])]
+        expected = ChargeSet(charges).E(self.x)
+        e = self.mesh.solve(ChargeSet(charges))
+        self.assertTrue((norm(e-expected) < 0.01*norm(expected)).all())
+
+    def test_V(self):
+        """Tests the mesh potential against direct summation."""
+        charges = self.charges[:3]
+        expected = ChargeSet(charges).V(self.x)
+        v = self.mesh.solve(ChargeSet(charges), potential=True)
+        self.assertEqual(v.shape, expected.shape)
+        self.assertTrue((fabs(v-expected) < 0.01*fabs(expected).max()).all())
+
+
+class TestChargeIndex(unittest.TestCase):
+    """Tests the ChargeIndex class."""
+
+    def test_query(self):
+        """Tests proximity queries against the charges' own tests."""
+        charges = [PointCharge(1, [0, 0]), LineCharge(1, [-1, -1], [1, 0.5]),
+                   PointCharge(-1, [0.005, 0]), PointChargeFlatland(0, [2, 2])]
+        index = ChargeIndex(charges)
+        x = array([[0, 0.009], [0.012, 0.001], [0.5, 0.13], [0.5, 0.13+0.02],
+                   [1.005, 0.5], [2, 2.0099], [2, 2.011], [-1.009, -1.001],
+                   [5, 5], [-7, 3]])
+        expected = [next((k for k, c in enumerate(charges) if c.is_close(p)),
+                         -1) for p in x]
+        self.assertEqual(expected, [0, 2, 1, -1, 1, 3, -1, 1, -1, -1])
+        self.assertTrue((index.query(x) == expected).all())
+        self.assertEqual(index.query(x[4]), 1)
+        self.assertTrue(index.is_close(x[5]))
+        self.assertFalse(index.is_close(x[6]))
+        self.assertFalse(ChargeIndex([]).is_close([0, 0]))
+
+    def test_long_line(self):
+        """Tests that a long line charge only occupies cells along it."""
+        charge = LineCharge(1, [-40, -30], [40, 30])
+        index = ChargeIndex([charge])
+        self.assertLess(len(index.keys), 4*100/index.cellsize)
+        x = numpy.random.RandomState(0).uniform(-0.03, 0.03, (1000, 2)) + \
+          linspace(-5, 5, 1000)[:, newaxis]*[8, 6]
+        self.assertTrue((index.is_close(x) == charge.is_close(x)).all())
+
+
+class TestFieldLine(unittest.TestCase):
+    """Tests the FieldLine class."""
+
+    def test_grow(self):
+        """Tests growing the line in both directions."""
+        fieldline = FieldLine([[0, 0]])
+        for i in range(1, 100):
+            fieldline.append([i, 0])
+            fieldline.prepend([-i, 0])
+        self.assertEqual(len(fieldline), 199)
+        self.assertEqual(fieldline.x.shape, (199, 2))
+        self.assertTrue((fieldline.x[:, 0] == range(-99, 100)).all())
+        fieldline.trim()
+        self.assertTrue((fieldline.x[:, 0] == range(-99, 100)).all())
+
+    def test_arrows(self):
+        """Tests the arrow positions."""
+        x, dx = FieldLine([[i, 0] for i in range(11)]).arrows()
+        self.assertEqual(x.tolist(), [[5, 0]])
+        self.assertEqual(dx.tolist(), [[1, 0]])
+        x, dx = FieldLine([[i, 0] for i in range(300)]).arrows()
+        self.assertEqual(x.tolist(), [[75, 0], [225, 0]])
+        x, _ = FieldLine([[i, 0] for i in range(300)]).arrows(endarrows=False)
+        self.assertEqual(x.tolist(), [[75, 0]])
+        x, _ = FieldLine([[0, 0], [1, 0]]).arrows()
+        self.assertEqual(x.shape, (0, 2))
+
+    def test_simplify(self):
+        """Tests field line simplification."""
+        a = linspace(0, numpy.pi, 1001)
+        x = array([cos(a), sin(a)]).T
+        fieldline = FieldLine(x)
+        arrows = fieldline.arrows()
+        self.assertIs(fieldline.simplify(1e-3), fieldline)
+        self.assertLess(len(fieldline), 100)
+        self.assertTrue((fieldline.x[[0, -1]] == x[[0, -1]]).all())
+        for y, z in zip(fieldline.arrows(), arrows):
+            self.assertTrue((y == z).all())
+        b = arctan2(fieldline.x[:, 1], fieldline.x[:, 0])
+        sagitta = 1 - cos(numpy.diff(b)/2)
+        self.assertLessEqual(sagitta.max(), 1e-3)
+        self.assertEqual(len(FieldLine([[0, 0], [1, 0], [2, 0], [3, 0]])
+                             .simplify(1e-3)), 2)
+        loop = FieldLine([[0, 0], [1, 0], [1, 1], [0, 0]]).simplify(1e-3)
+        self.assertEqual(len(loop), 4)
+        fieldline.append([0, 0])
+        self.assertEqual(len(fieldline.arrows()[0]), 1)
+
+    def test_plot_fieldlines(self):
+        """Tests plotting field lines as collections."""
+        fieldlines = [FieldLine([[i, j] for i in range(300)])
+                      for j in range(3)]
+        heads = arrowheads(fieldlines, 0.2)
+        self.assertEqual(heads.shape, (6, 3, 2))
+        self.assertTrue(isclose(heads[0], [[75.01, 0.1], [75.21, 0],
+                                           [75.01, -0.1]]).all())
+        self.assertEqual(arrowheads([], 0.2).shape, (0, 3, 2))
+        pyplot.figure()
+        lines, heads = plot_fieldlines(fieldlines, linewidth=2)
+        self.assertEqual(len(lines.get_segments()), 3)
+        self.assertEqual(len(heads.get_paths()), 6)
+        self.assertEqual(list(pyplot.gca().collections), [lines, heads])
+        pyplot.close()
+
 
 class TestElectricField(unittest.TestCase):
     """Tests the ElectricField class."""
@@ -193,6 +589,31 @@ class TestElectricField(unittest.TestCase):
         self.assertTrue(isclose(vector([[0, 0], [3, 0], [0, 1]]),
                                 [[-4, 0], [0.375, 0], [-sqrt(2), 0]]).all())
 
+    def test_modified_charges(self):
+        """Tests that modified, added and removed charges are repacked."""
+        electrostatics.init(-4, 4, -3, 3)
+        grid = self.field.sample_grid((9, 7))
+        self.field.charges[0].q = -1
+        z = self.field.sample_grid((9, 7))[2]
+        self.assertFalse(isclose(z, grid[2]).all())
+        self.assertTrue(isclose(self.field.vector([0, 0]), [-3, 0]).all())
+        self.field.charges[1].x[0] = 2
+        self.field.lines([[0, 0.5]])
+        self.assertTrue(isclose(self.field.vector([0, 0]), [-1.5, 0]).all())
+        self.field.charges.append(PointCharge(1, [0, 1]))
+        self.field.refresh()
+        self.assertTrue(isclose(self.field.vector([0, 0]), [-1.5, -1]).all())
+        self.assertTrue(self.field.is_close([0, 1]))
+        del self.field.charges[2]
+        self.field.refresh()
+        self.assertFalse(self.field.is_close([0, 1]))
+
+        potential = Potential(self.field.charges)
+        v = potential.magnitude([0, 1])
+        self.field.charges[0].q = -2
+        potential.refresh()
+        self.assertLess(potential.magnitude([0, 1]), v)
+
     def test_magnitude(self):
         """Tests the electric field magnitude."""
         magnitude = self.field.magnitude
@@ -244,6 +665,474 @@ class TestElectricField(unittest.TestCase):
         self.assertTrue(isclose(projection([[0, 0], [3, 0], [0, 1]], a1),
                                 array([4, -0.375, sqrt(2)])*cos(a2)).all())
 
+    def test_lines(self):
+        """Tests batched field-line tracing against line()."""
+        electrostatics.init(-4, 4, -3, 3)
+        seeds = [[-0.9, 0.1], [1.1, -0.2], [0, 2]]
+        lines = self.field.lines(seeds)
+        self.assertEqual(len(lines), 3)
+        for seed, fieldline in zip(seeds, lines):
+            expected = array(self.field.line(seed).x)
+            x = array(fieldline.x)
+            self.assertEqual(x.shape, expected.shape)
+            self.assertTrue(isclose(x[[0, -1]], expected[[0, -1]],
+                                    atol=1e-4).all())
+
+    def test_write_grids(self):
+        """Tests tiled evaluation into memory-mapped files."""
+        electrostatics.init(-4, 4, -3, 3)
+        potential = Potential(self.field.charges)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            prefix = os.path.join(tmpdir, 'dipole')
+            grids = write_grids(self.field, prefix, (9, 7), maxbytes=2000)
+            self.assertTrue(os.path.exists(prefix + '-V.npy'))
+            x, y, z = self.field.sample_grid((9, 7), cache=False)
+            self.assertTrue(isclose(grids['x'], x[0]).all())
+            self.assertTrue(isclose(grids['y'], y[:, 0]).all())
+            self.assertTrue(isclose(grids['E'], z, equal_nan=True).all())
+            self.assertTrue(isclose(grids['Ex'][2, 3],
+                                    self.field.vector([x[2, 3], y[2, 3]])[0]))
+            z = potential.sample_grid((9, 7), cache=False)[2]
+            self.assertTrue(isclose(grids['V'], z, equal_nan=True).all())
+            del grids
+
+            tracemalloc.start()
+            try:
+                grids = write_grids(self.field, prefix, (400, 300),
+                                    maxbytes=2**20)
+                peak = tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+            self.assertLess(peak, 2**20)
+            del grids
+
+            field = ElectricField([PointChargeFlatland(1, [0.5, 0.5])])
+            grids = write_grids(field, prefix + '-flatland', 5)
+            self.assertEqual(sorted(grids), ['E', 'Ex', 'Ey', 'x', 'y'])
+            del grids
+
+    def test_plot_adaptive(self):
+        """Tests plotting with adaptive sampling."""
+        electrostatics.init(-4, 4, -3, 3)
+        pyplot.figure()
+        self.field.plot(method='adaptive', resolution=50)
+        Potential(self.field.charges).plot(method='adaptive', resolution=50)
+        self.assertEqual(len(pyplot.gca().collections), 2)
+        pyplot.close()
+
+    def test_terminated(self):
+        """Tests the batched termination test."""
+        electrostatics.init(-4, 4, -3, 3)
+        x = [[-1, 0.001], [1.005, 0], [0, 0], [5, 0], [0, -3.5], [2, 2]]
+        self.assertEqual(self.field.terminated(x).tolist(),
+                         [True, True, False, True, True, False])
+        self.assertTrue(self.field.terminated(x[0]))
+        self.assertFalse(self.field.terminated(x[2]))
+
+    def test_domain(self):
+        """Tests fields with their own domains, used from several threads."""
+        electrostatics.init(-4, 4, -3, 3)
+        charges = self.field.charges
+        seeds = [[-0.9, 0.1], [1.1, -0.2], [0, 2], [0, -1]]
+        fields = [ElectricField(charges, domain=Domain(-2, 2, -2, 2)),
+                  ElectricField(charges, domain=Domain(-8, 8, -6, 6))]
+        expected = [field.lines(seeds) for field in fields]
+        with ThreadPoolExecutor(4) as pool:
+            results = list(pool.map(lambda field: field.lines(seeds),
+                                    fields*4))
+        for i, lines in enumerate(results):
+            for fieldline, x in zip(lines, expected[i%2]):
+                self.assertEqual(fieldline.x.shape, x.x.shape)
+                self.assertTrue(numpy.allclose(fieldline.x, x.x))
+        self.assertLess(numpy.abs(expected[0][1].x).max(), 2.1)
+        self.assertGreater(numpy.abs(expected[1][1].x).max(), 3)
+        self.assertEqual(fields[0].linekey('line', seeds[0], 0, 'fixed'),
+                         fields[0].linekey('line', seeds[0], 0, 'fixed'))
+        self.assertNotEqual(fields[0].linekey('line', seeds[0], 0, 'fixed'),
+                            fields[1].linekey('line', seeds[0], 0, 'fixed'))
+        x, _, _ = fields[0].sample_grid(5, cache=False)
+        self.assertEqual(x[0].tolist(), [-2, -1, 0, 1, 2])
+
+    def test_lines_parallel(self):
+        """Tests field-line tracing in a process pool."""
+        electrostatics.init(-4, 4, -3, 3)
+        seeds = [[-0.9, 0.1], [1.1, -0.2], [0, 2], [0, -1], [-0.5, 0.5]]
+        expected = self.field.lines(seeds)
+        lines = self.field.lines(seeds, workers=2)
+        self.assertEqual(len(lines), len(seeds))
+        for fieldline, x in zip(lines, expected):
+            self.assertEqual(fieldline.x.shape, x.x.shape)
+            self.assertTrue(numpy.allclose(fieldline.x, x.x))
+
+    def test_line_adaptive(self):
+        """Tests field-line tracing with adaptive steps."""
+        electrostatics.init(-40, 40, -30, 30)
+        expected = self.field.line([0, 10])
+        for fieldline in [self.field.line([0, 10], tol=0.05),
+                          self.field.lines([[0, 10]], tol=0.05)[0]]:
+            self.assertLess(len(fieldline), len(expected)/5)
+            self.assertTrue(isclose(fieldline.x[[0, -1]], expected.x[[0, -1]],
+                                    atol=0.01).all())
+
+    def test_line_stats(self):
+        """Tests the tracing statistics carried by field lines."""
+        electrostatics.init(-4, 4, -3, 3)
+        seeds = [[-0.9, 0.1], [3.9, 0]]
+        for lines in [[self.field.line(seed) for seed in seeds],
+                      self.field.lines(seeds)]:
+            forward, backward = lines[0].stats
+            self.assertEqual((forward.direction, backward.direction), (1, -1))
+            self.assertEqual(forward.reason, TraceStats.CHARGE)
+            self.assertEqual(forward.charge, 0)  # Lines end on -ve charges
+            self.assertEqual(backward.charge, 1)
+            self.assertEqual([s.reason for s in lines[1].stats],
+                             [TraceStats.DOMAIN, TraceStats.CHARGE])
+            self.assertEqual(sum(s.steps for s in lines[0].stats),
+                             len(lines[0]) - 1)
+            self.assertTrue(all(s.nfev > 0 and s.time > 0
+                                for line in lines for s in line.stats))
+
+        self.field.maxsteps = 10
+        for fieldline in [self.field.line(seeds[1]),
+                          self.field.lines(seeds[1:])[0]]:
+            self.assertEqual([s.reason for s in fieldline.stats],
+                             [TraceStats.BUDGET]*2)
+            self.assertEqual(len(fieldline), 21)
+
+        report = trace_report(lines + [FieldLine([[0, 0]])], worst=1)
+        self.assertIn('3 field lines (1 without stats), 4 directions', report)
+        self.assertIn('charge 3, domain 1, failure 0, budget 0', report)
+
+    def test_line_map(self):
+        """Tests field-line tracing through a field map."""
+        electrostatics.init(-4, 4, -3, 3)
+        expected = self.field.line([0, 1])
+        for fieldline in [self.field.line([0, 1], mode='map'),
+                          self.field.lines([[0, 1]], mode='map')[0]]:
+            self.assertTrue(isclose(fieldline.x[[0, -1]], expected.x[[0, -1]],
+                                    atol=0.01).all())
+        self.assertIs(self.field.fieldmap(), self.field.fieldmap())
+        self.assertRaises(ValueError, self.field.line, [0, 1], mode='foo')
+
+    def test_sample_grid(self):
+        """Tests batched sampling of the field magnitude over the view."""
+        electrostatics.init(-4, 4, -3, 3)
+        x, y, z = self.field.sample_grid((9, 7))
+        self.assertEqual(z.shape, (7, 9))
+        for i, j in [(0, 0), (3, 4), (6, 8)]:
+            self.assertTrue(isclose(z[i, j],
+                                    self.field.magnitude([x[i, j], y[i, j]])))
+
+        potential = Potential(self.field.charges)
+        x, y, z = potential.sample_grid(5)
+        self.assertEqual(z.shape, (5, 5))
+        self.assertTrue(isclose(z[1, 3], potential.magnitude([x[1, 3],
+                                                              y[1, 3]])))
+
+        expected = self.field.sample_grid((9, 7))[2]
+        z = self.field.sample_grid((9, 7), method='fft')[2]
+        self.assertTrue(isclose(z, expected, rtol=0.01, equal_nan=True).all())
+        self.assertRaises(ValueError, self.field.sample_grid, 9, 'foo')
+
+
+class TestGridCache(unittest.TestCase):
+    """Tests the GridCache class."""
+
+    def setUp(self):
+        """Sets up a dipole and a small cache."""
+        electrostatics.init(-4, 4, -3, 3)
+        self.charges = [PointCharge(-2, [-1, 0]), PointCharge(2, [1, 0])]
+        self.cache = GridCache(maxbytes=2*3*9*7*8)  # Holds two grids
+
+    def test_sample_grid(self):
+        """Tests caching of sampled grids."""
+        field = ElectricField(self.charges)
+        grid = field.sample_grid((9, 7), cache=self.cache)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 1))
+        self.assertIs(field.sample_grid((9, 7), cache=self.cache), grid)
+        self.assertEqual((self.cache.hits, self.cache.misses), (1, 1))
+        self.assertFalse(grid[2].flags.writeable)
+
+        # Equal configurations share grids; other specs and charges do not
+        field = ElectricField([PointCharge(-2, [-1, 0]),
+                               PointCharge(2, [1, 0])])
+        self.assertIs(field.sample_grid((9, 7), cache=self.cache), grid)
+        electrostatics.init(-4, 4, -3, 3, zoom=2)
+        self.assertIsNot(field.sample_grid((9, 7), cache=self.cache), grid)
+        electrostatics.init(-4, 4, -3, 3)
+        field.charges[0].q = -1
+        field.refresh()
+        z = field.sample_grid((9, 7), cache=self.cache)[2]
+        self.assertFalse(isclose(z, grid[2]).all())
+        potential = Potential(self.charges)
+        z = potential.sample_grid((9, 7), cache=self.cache)[2]
+        self.assertFalse(isclose(z, grid[2]).all())
+        self.assertEqual((self.cache.hits, self.cache.misses), (2, 4))
+
+    def test_eviction(self):
+        """Tests that the least recently used grids are evicted."""
+        field = ElectricField(self.charges)
+        grids = [field.sample_grid((9, 7), method, cache=self.cache)
+                 for method in ['direct', 'fft']]
+        field.sample_grid((9, 7), cache=self.cache)
+        field.sample_grid((7, 9), cache=self.cache)
+        self.assertEqual(len(self.cache.grids), 2)
+        self.assertIs(field.sample_grid((9, 7), cache=self.cache), grids[0])
+        self.assertIsNot(field.sample_grid((9, 7), 'fft', cache=self.cache),
+                         grids[1])
+        self.assertLessEqual(self.cache.nbytes, self.cache.maxbytes)
+
+        self.cache.clear()
+        self.assertEqual(len(self.cache.grids), 0)
+        self.assertEqual((self.cache.hits, self.cache.misses), (0, 0))
+        self.assertIsNot(field.sample_grid((9, 7), cache=False), grids[0])
+        self.assertEqual(len(self.cache.grids), 0)
+
+    def test_threads(self):
+        """Tests sharing the cache between threads."""
+        cache = GridCache(maxbytes=4*80)  # Holds four grids
+        def work(i):
+            """Puts and gets grids under overlapping keys."""
+            for j in range(2000):
+                key = str((i + j) % 6)
+                if cache.get(key) is None:
+                    cache.put(key, (numpy.zeros(10),))
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)  # Switches threads often
+        try:
+            with ThreadPoolExecutor(8) as pool:
+                list(pool.map(work, range(8)))
+        finally:
+            sys.setswitchinterval(interval)
+        self.assertEqual(cache.nbytes,
+                         sum(a.nbytes for grid in cache.grids.values()
+                             for a in grid))
+        self.assertLessEqual(cache.nbytes, cache.maxbytes)
+        self.assertEqual(cache.hits + cache.misses, 8*2000)
+
+
+class TestDiskCache(unittest.TestCase):
+    """Tests the DiskCache class."""
+
+    def setUp(self):
+        """Sets up a dipole and a cache directory."""
+        electrostatics.init(-4, 4, -3, 3)
+        self.field = ElectricField([PointCharge(-2, [-1, 0]),
+                                    PointCharge(2, [1, 0])])
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'cache')
+
+    def tearDown(self):
+        """Removes the cache directory."""
+        self.tmpdir.cleanup()
+
+    def test_lines(self):
+        """Tests that traced lines persist between cache instances."""
+        cache = DiskCache(self.path)
+        seeds = [[-0.9, 0.1], [1.1, -0.2]]
+        expected = [fieldline.x for fieldline in self.field.lines(seeds)]
+        lines = self.field.lines(seeds, cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (0, 2))
+        x = self.field.line(seeds[0], tol=0.05, cache=cache).x
+
+        cache = DiskCache(self.path)  # E.g., in another process
+        lines = self.field.lines(seeds[::-1] + [[0, 2]], cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (2, 1))
+        for expected_x, fieldline in zip(expected[::-1], lines):
+            self.assertTrue(numpy.array_equal(fieldline.x, expected_x))
+        fieldline = self.field.line(seeds[0], tol=0.05, cache=cache)
+        self.assertTrue(numpy.array_equal(fieldline.x, x))
+        self.assertEqual(cache.hits, 3)
+
+        # Lines traced with other settings are not shared
+        self.field.rtol = self.field.atol = 1e-2
+        self.field.lines(seeds, cache=cache)
+        self.field.lines(seeds, mode='map', cache=cache)
+        self.field.mapsettings = None, 4, 8, 10**6
+        self.field.lines(seeds, mode='map', cache=cache)
+        self.assertEqual((cache.hits, cache.misses), (3, 7))
+
+    def test_eviction(self):
+        """Tests that the cache is bounded in size."""
+        cache = DiskCache(self.path)
+        grid = self.field.sample_grid((9, 7), cache=cache)
+        self.assertTrue(numpy.array_equal(
+            self.field.sample_grid((9, 7), cache=cache)[2], grid[2],
+            equal_nan=True))
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        path = os.path.join(self.path, os.listdir(self.path)[0])
+        size = os.path.getsize(path)
+
+        cache.maxbytes = 2*size + 100  # Two grids of about this size
+        for resolution in [(9, 7), (7, 9), (9, 7), (8, 8)]:
+            self.field.sample_grid(resolution, cache=cache)
+        self.assertLessEqual(len(os.listdir(self.path)), 2)
+        self.assertLessEqual(cache.nbytes, cache.maxbytes)
+
+        # Once full, the cache is emptied to 3/4 of its limit at a time
+        cache = DiskCache(self.path, maxbytes=4*size + 100)
+        cache.clear()
+        for i in range(8):
+            cache.put(electrostatics.fingerprint(i), grid)
+            self.assertEqual(cache.nbytes, sum(
+                os.path.getsize(os.path.join(self.path, name))
+                for name in os.listdir(self.path)))
+            self.assertEqual(len(os.listdir(self.path)),
+                             [1, 2, 3, 4, 3, 4, 3, 4][i])
+        self.assertIsNone(cache.get(electrostatics.fingerprint('missing')))
+        cache.clear()
+        self.assertEqual(os.listdir(self.path), [])
+
+
+class TestFieldGrid(unittest.TestCase):
+    """Tests the FieldGrid class."""
+
+    def setUp(self):
+        """Sets up a biased dipole with a third, uncharged point."""
+        electrostatics.init(-4, 4, -3, 3)
+        self.charges = [PointCharge(2, [0, 0]), PointCharge(-1, [2, 0]),
+                        PointCharge(0, [3, 0]), LineCharge(1, [-3, -2],
+                                                           [-3, 2])]
+        self.field = ElectricField(self.charges)
+
+    def test_update(self):
+        """Tests incremental updates against resampling."""
+        grid = FieldGrid(self.field, (9, 7))
+        grid.update(self.charges[2], q=0.5)
+        grid.update(self.charges[1], x=[1.5, 0.5])
+        grid.update(self.charges[0], x=[0.3, 0.2], q=3)  # Was on a node
+        grid.update(self.charges[3], q=-2)
+        self.assertEqual(self.charges[1].x.tolist(), [1.5, 0.5])
+        self.assertTrue(isclose(self.field.chargeset.q, [3, -1, 0.5]).all())
+
+        e, v = grid.E, grid.V
+        grid.recompute()
+        self.assertEqual(e.shape, (7, 9, 2))
+        self.assertTrue(isclose(e, grid.E, equal_nan=True).all())
+        self.assertTrue(isclose(v, grid.V, equal_nan=True).all())
+        self.assertTrue(numpy.isfinite(e[3, 6]).all())  # The old x of q=-1
+        self.assertRaises(ValueError, grid.update, PointCharge(1, [0, 0]),
+                          q=2)
+
+        # Attributes that cannot be set leave the charge and grids as they
+        # were
+        e = grid.E.copy()
+        self.assertRaises(AttributeError, grid.update, self.charges[3], q=-1,
+                          lam=2)
+        self.assertEqual(self.charges[3].q, -2)
+        self.assertTrue(isclose(grid.E, e, equal_nan=True).all())
+
+    def test_update_packed(self):
+        """Tests that updates only repack the edited charge."""
+        grid = FieldGrid(self.field, (9, 7))
+        chargeset, key = self.field.chargeset, self.field.key
+        grid.update(self.charges[1], x=[1.5, 0.5], q=-2)
+        grid.update(self.charges[3], x2=[-3, 3])
+        self.assertIs(self.field.chargeset, chargeset)
+        self.assertNotEqual(self.field.key, key)
+        expected = ChargeSet(self.charges)
+        for name in ['sites', 'x', 'q', 'x1', 'x2', 'lam']:
+            self.assertTrue((getattr(chargeset, name) ==
+                             getattr(expected, name)).all())
+        self.assertTrue(self.field.is_close([1.5, 0.5]))
+        self.assertIs(self.field.packed(), chargeset)
+
+        # Keys depend on the charges, not on the history of edits
+        self.assertEqual(self.field.key, ElectricField(self.charges).key)
+        key = self.field.key
+        grid.update(self.charges[1], q=-3)
+        grid.update(self.charges[1], q=-2)
+        self.assertEqual(self.field.key, key)
+
+        grid.update(self.charges[0], q=0)  # Must be repacked
+        self.assertIsNot(self.field.chargeset, chargeset)
+
+        field = ElectricField(self.charges[:2], theta=0.3)
+        field.update(self.charges[1])
+        self.assertTrue(isclose(field.vector([0, 1]),
+                                ElectricField(self.charges[:2]).vector([0, 1]),
+                                rtol=0.01).all())
+
+    def test_flatland(self):
+        """Tests that the potential is omitted for Flatland charges."""
+        field = ElectricField([PointChargeFlatland(1, [0.5, 0.5])])
+        grid = FieldGrid(field, 5)
+        self.assertIsNone(grid.V)
+        grid.update(field.charges[0], q=2)
+        e = grid.E
+        grid.recompute()
+        self.assertTrue(isclose(e, grid.E).all())
+
+
+class TestRenderer(unittest.TestCase):
+    """Tests the Renderer class."""
+
+    def test_render(self):
+        """Tests rendering several frames without pyplot."""
+        charges = [PointCharge(-2, [-1, 0]), PointCharge(2, [1, 0]),
+                   LineCharge(1, [0, -2], [0, -1])]
+        domain = Domain(-4, 4, -3, 3)
+        field = ElectricField(charges, domain=domain)
+        potential = Potential(charges, domain=domain)
+        fieldlines = field.lines([[-0.9, 0.1], [-0.9, -0.1], [1, 2]])
+        figures = pyplot.get_fignums()
+        renderer = Renderer(dpi=20, domain=domain)
+        children, layers = [], []
+        with tempfile.TemporaryDirectory() as path, \
+          warnings.catch_warnings():
+            warnings.simplefilter('error',
+                                  matplotlib.MatplotlibDeprecationWarning)
+            for q in [2, 3]:
+                charges[1].q = q
+                field.refresh()
+                potential.refresh()
+                renderer.magnitude(field, resolution=50)
+                renderer.potential(potential, resolution=50)
+                renderer.fieldlines(fieldlines[:q])
+                renderer.charges(charges)
+                renderer.savefig(os.path.join(path, 'frame%d.png' % q))
+                children.append(len(renderer.ax.get_children()))
+                layers.append(dict(renderer.layers))
+            renderer.savefig(os.path.join(path, 'frame.svg'))
+            self.assertEqual(sorted(os.listdir(path)),
+                             ['frame.svg', 'frame2.png', 'frame3.png'])
+        self.assertEqual(children[0], children[1])
+        for layer in ['fieldlines', 'charges']:  # Updated in place
+            self.assertEqual(layers[0][layer], layers[1][layer])
+        self.assertIsNot(layers[0]['magnitude'][0], layers[1]['magnitude'][0])
+        self.assertEqual(len(layers[1]['fieldlines'][0].get_segments()), 3)
+        self.assertTrue(isclose(layers[1]['charges'][1].get_radius(),
+                                0.1*(sqrt(3)/2 + 1)))
+        self.assertEqual(pyplot.get_fignums(), figures)
+        self.assertEqual(renderer.ax.get_xlim(), (-4, 4))
+        self.assertEqual(renderer.draw().shape, (90, 120, 4))
+        renderer.clear()
+        self.assertEqual(renderer.layers, {})
+
+
+class TestFieldMap(unittest.TestCase):
+    """Tests the FieldMap class."""
+
+    def test_vector(self):
+        """Tests the interpolated field against the exact field."""
+        electrostatics.init(-4, 4, -3, 3)
+        field = ElectricField([PointCharge(-2, [-1, 0]), PointCharge(2, [1, 0]),
+                               LineCharge(1, [0, 2], [1, 2])])
+        fieldmap = FieldMap(field)
+        self.assertEqual(len(fieldmap.levels), 2)
+
+        # Interpolated points are within the documented error bound
+        x = array([[0, 0], [3, 2.5], [-2.5, -1], [-3.9, 2.9], [0.5, 1.5]])
+        e, expected = fieldmap.vector(x), field.vector(x)
+        error = norm(e-expected)/norm(expected)
+        self.assertTrue((error < 1.5/fieldmap.near**2).all())
+        for p, expected in zip(x, e):
+            self.assertTrue(isclose(fieldmap.vector(p), expected).all())
+
+        # Points near charges are evaluated exactly
+        x = array([[-1.001, 0.002], [0.5, 2.001], [10, 10]])
+        self.assertTrue((fieldmap.vector(x) == field.vector(x)).all())
+
 
 class TestGaussianCircle(unittest.TestCase):
     """Tests the GaussianCircle class."""
@@ -297,6 +1186,28 @@ class TestGaussianCircle(unittest.TestCase):
         x2[:, 1] = fabs(x2[:, 1])
         self.assertTrue(isclose(x1, x2).all())
 
+    def test_fluxpoints(self):
+        """Tests the closed-form flux points against sampled ones."""
+        for kind in [PointCharge, PointChargeFlatland]:
+            charges = [kind(-2, [0, 0]), kind(0.5, [0.1, 0.1]), kind(3, [2, 1])]
+            circles = [GaussianCircle([0, 0], 0.5, 0.3),
+                       GaussianCircle([2, 1], 0.1)]
+            field = ElectricField(charges)
+            sampled = ElectricField(charges + [LineCharge(0, [9, 9], [9, 8])])
+            expected = fluxpoints(circles, sampled, 12)
+            points = fluxpoints(circles, field, 12)
+            self.assertEqual(len(points), 2)
+            for x, y, circle in zip(points, expected, circles):
+                self.assertEqual(x.shape, (12, 2))
+                self.assertTrue(isclose(x, y, rtol=0, atol=1e-6).all())
+                self.assertTrue(isclose(x, circle.fluxpoints(field, 12)).all())
+            self.assertTrue(isclose(circles[0].fluxpoints(field, 1),
+                                    [[0.5*cos(0.3), 0.5*sin(0.3)]]).all())
+            with self.assertRaises(AssertionError):
+                GaussianCircle([1, 0.5], 0.3).fluxpoints(field, 12)
+            with self.assertRaises(AssertionError):
+                GaussianCircle([1, 0.5], 0.3).fluxpoints(sampled, 12)
+
 
 #-----------------------------------------------------------------------------
 # main()
@@ -307,9 +1218,21 @@ def main():
     suite = unittest.TestSuite()
 
     suite.addTests(unittest.makeSuite(TestFunctions))
+    suite.addTests(unittest.makeSuite(TestDomain))
     suite.addTests(unittest.makeSuite(TestPointCharge))
     suite.addTests(unittest.makeSuite(TestLineCharge))
+    suite.addTests(unittest.makeSuite(TestChargeSet))
+    suite.addTests(unittest.makeSuite(TestBackend))
+    suite.addTests(unittest.makeSuite(TestBarnesHut))
+    suite.addTests(unittest.makeSuite(TestParticleMesh))
+    suite.addTests(unittest.makeSuite(TestChargeIndex))
+    suite.addTests(unittest.makeSuite(TestFieldLine))
     suite.addTests(unittest.makeSuite(TestElectricField))
+    suite.addTests(unittest.makeSuite(TestGridCache))
+    suite.addTests(unittest.makeSuite(TestDiskCache))
+    suite.addTests(unittest.makeSuite(TestFieldGrid))
+    suite.addTests(unittest.makeSuite(TestRenderer))
+    suite.addTests(unittest.makeSuite(TestFieldMap))
     suite.addTests(unittest.makeSuite(TestGaussianCircle))
 
     result = unittest.TextTestRunner(verbosity=1).run(suite)